@@ -1,6 +1,6 @@
 import dash_html_components as html
 from testrun_utils import STATUS_NOT_RUN, STATUS_BLOCKED, STATUS_FAILED, STATUS_PASSED, STATUS_INPROGRESS
-from testrun_utils import filter_df, get_testruns_for_current_week, get_status_names
+from testrun_utils import filter_df, get_testruns_for_current_week, get_status_names, DATE_COLUMNS
 import pandas as pd
 import dash_table
 
@@ -21,6 +21,8 @@ Returns:
 def get_current_status_pie_chart(df, testcycle, testgroup, priority=None, week=None, colormap=None):
     df1 = filter_df(df, testcycle_key=testcycle, testgroup_key=testgroup, priority_key=priority, week_key=week)
     counts = df1['status'].value_counts()
+    # categorical columns also count the categories without rows
+    counts = counts[counts > 0]
 
     status_names = []
     values = []
@@ -67,6 +69,8 @@ Returns:
 def get_exec_method_pie_chart(df, testcycle, testgroup, priority=None, week=None, colormap=None):
     df1 = filter_df(df, testcycle_key=testcycle, testgroup_key=testgroup, priority_key=priority, week_key=week)
     counts = df1['execution_method'].value_counts()
+    # categorical columns also count the categories without rows
+    counts = counts[counts > 0]
 
     exec_methods = []
     values = []
@@ -425,6 +429,12 @@ def get_testruns_table(df, testcycle, testgroup, priority, week, colormap, **kwa
     if df1 is None:
         return html.P('No test runs found!')
 
+    # show the dates without a time, only for the rows of the table
+    df1 = df1.copy()
+    for col in DATE_COLUMNS:
+        if col in df1.columns and pd.api.types.is_datetime64_any_dtype(df1[col]):
+            df1[col] = df1[col].dt.strftime('%Y-%m-%d')
+
     style_cell_conditional = [
                                  {
                                      'if': {'column_id': c},
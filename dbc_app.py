@@ -1,5 +1,3 @@
-import os
-import logger
 import dash
 from dash.dependencies import Input, Output, State
 import dash_core_components as dcc
@@ -11,8 +9,7 @@ from datetime import datetime as dt
 from datetime import timedelta
 from dateutil import parser
 
-from testrun_utils import get_testplan_labels, \
-    get_testcycle_labels, \
+from testrun_utils import get_testcycle_labels, \
     get_testgroup_labels,\
     get_testcycle_from_label, \
     get_testgroup_from_label, \
@@ -20,13 +17,12 @@ from testrun_utils import get_testplan_labels, \
     get_priority_from_label, \
     get_planned_week_labels, \
     get_planned_week_from_label, \
-    json_to_df, \
-    retrieve_testruns
+    get_empty_df
 
 import charts
 from charts import get_chart_types, get_default_colormap
 import redis_data
-import testrun_utils
+import local_snapshot
 
 
 # ids for interactive elements
@@ -159,42 +155,45 @@ server = app.server
 
 
 redis_inst = redis_data.get_redis_inst()
-jama_url = os.environ.get('JAMA_API_URL')
-jama_api_username = os.environ.get('JAMA_API_USERNAME')
-jama_api_password = os.environ.get('JAMA_API_PASSWORD')
+# without Redis, the data is read from the local snapshot written by update.py
+snapshot = local_snapshot.snapshot_reader() if redis_inst is None else None
 
-if jama_url is None:
-    jama_url = 'https://paperclip.idirect.net'
 
+# test plans decoded by this process and the dataset version they were read at, kept up to
+# date with the change-log in Redis
+plan_data = {}
 
-@cache.memoize()
-def get_data():
-    """
-    If Redis is available, retrieve the dataframe from Redis. This dataframe is periodically updated through the redis
-    task.
 
-    If Redis is not available, directly get the data from Contour
-    """
-    if redis_inst is not None:
-        return redis_data.get_dataframe_json(redis_inst)
-
-    # Attempt to get data directly from Contour
-    try:
-        df = retrieve_testruns(jama_url=jama_url,
-                               jama_username=jama_api_username,
-                               jama_password=jama_api_password)
-    except Exception as e:
-        logger.error(f'caught exception {e} trying to get test runs')
-        return None
+'''Get the test runs of a test plan
 
-    if df is None:
-        logger.error('cannot retrieve data from Jama/Contour server. Check config file!')
-        return None
+With Redis, the test plan is kept in memory and only the changes since it was read are
+applied when the data in Redis changes. Without Redis, the test plan is read from the local
+snapshot, which is only loaded again when the updater replaces it. A test plan that is not
+in the data, e.g. because it was removed since the page was loaded, has no test runs.
+'''
+def get_plan_df(testplan):
+    if redis_inst is None:
+        df = snapshot.get_dataframe(testplan)
+    else:
+        version, df = plan_data.get(testplan, (None, None))
+        version, df = redis_data.update_dataframe(redis_inst, testplan, df, version)
+        plan_data[testplan] = (version, df)
+    return df if df is not None else get_empty_df()
 
-    print(df)
-    df.to_csv('contour_data.csv', index=False)
-    jsonified_df = testrun_utils.df_to_json(df)
-    return jsonified_df
+
+'''Get the date and time the data was last modified'''
+def get_modified_datetime():
+    if redis_inst is None:
+        return snapshot.get_modified_datetime()
+    return redis_data.get_modified_datetime(redis_inst)
+
+
+'''Get the daily status snapshots of a test plan for the test progress chart, None without Redis'''
+@cache.memoize()
+def get_status_snapshots(testplan):
+    if redis_inst is None:
+        return None
+    return redis_data.get_status_snapshots(redis_inst, testplan)
 
 
 init_value = lambda a: a[0]['value'] if len(a) > 0 and 'value' in a[0] else None
@@ -214,15 +213,18 @@ def get_value_from_options(options, current_value=None):
 '''get testplans and first value'''
 @cache.memoize()
 def get_testplan_options():
-    df = json_to_df(get_data())
-    testplans =  [{'label': i, 'value': i} for i in get_testplan_labels(df)]
+    if redis_inst is not None:
+        labels = redis_data.get_testplans(redis_inst)
+    else:
+        labels = snapshot.get_testplans()
+    testplans =  [{'label': i, 'value': i} for i in labels]
     return testplans
 
 
 '''get testplans and first value'''
 @cache.memoize()
 def get_testcycle_options(testplan):
-    df = json_to_df(get_data())
+    df = get_plan_df(testplan)
     testcycles = [{'label': i, 'value': i}
                    for i in get_testcycle_labels(df, testplan_key=testplan)]
     return testcycles
@@ -231,7 +233,7 @@ def get_testcycle_options(testplan):
 '''get testplans and first value'''
 @cache.memoize()
 def get_testgroup_options(testplan, testcycle):
-    df = json_to_df(get_data())
+    df = get_plan_df(testplan)
     testgroups = [{'label': i, 'value': i}
                    for i in get_testgroup_labels(df,
                                                  testplan_key=testplan,
@@ -241,7 +243,7 @@ def get_testgroup_options(testplan, testcycle):
 '''Get priorities and first value'''
 @cache.memoize()
 def get_priority_options(testplan, testcycle, testgroup):
-    df = json_to_df(get_data())
+    df = get_plan_df(testplan)
     priorities =  \
         [{'label': i, 'value': i} for i in get_priority_labels(
             df, testplan_key=testplan,
@@ -252,7 +254,7 @@ def get_priority_options(testplan, testcycle, testgroup):
 
 @cache.memoize()
 def get_week_options(testplan, testcycle, testgroup):
-    df = json_to_df(get_data())
+    df = get_plan_df(testplan)
     weeks =  \
         [{'label': i, 'value': i} for i in get_planned_week_labels(
             df, testplan_key=testplan,
@@ -686,7 +688,7 @@ def get_card_layout(card_id):
 
 
 def serve_layout():
-    modified_datetime = redis_data.get_modified_datetime(redis_inst)
+    modified_datetime = get_modified_datetime()
 
     layout = dbc.Container(
         [
@@ -773,7 +775,7 @@ def update_last_modified(n, prev_last_modified):
         # TODO: When is this callback called with n == None
         raise PreventUpdate
 
-    last_modified = redis_data.get_modified_datetime(redis_inst)
+    last_modified = get_modified_datetime()
     if last_modified is None:
         # no data in Redis. TODO: Need to handle differently?
         raise PreventUpdate
@@ -814,13 +816,13 @@ def update_graph(modified_datetime, current_testplan):
     if modified_datetime is None:
         raise PreventUpdate
     # invalidate caches
-    cache.delete_memoized(get_data)
     cache.delete_memoized(get_testplan_options)
     cache.delete_memoized(get_testcycle_options)
     cache.delete_memoized(get_testgroup_options)
     cache.delete_memoized(get_priority_options)
     cache.delete_memoized(get_week_options)
     cache.delete_memoized(get_chart)
+    cache.delete_memoized(get_status_snapshots)
     testplan_options = get_testplan_options()
     testplan_value = get_value_from_options(testplan_options, current_testplan)
     status = f'Data last updated: {modified_datetime}'
@@ -936,7 +938,10 @@ def update_figure_with_week(is_open, testplan, testcycle, testgroup, priority, w
             else:
                 kwargs_to_pass[kwarg_key] = arg
 
-    df = json_to_df(get_data())
+    if chart_type == charts.FIG_TYPE_HISTORICAL_STATUS_LINE_CHART:
+        kwargs_to_pass['status_snapshots'] = get_status_snapshots(testplan)
+
+    df = get_plan_df(testplan)
     chart = get_chart(df, testplan, testcycle, testgroup, priority,
                       week_ui=week,
                       chart_type=chart_type,
@@ -980,7 +985,10 @@ def update_figure_without_week(is_open, testplan, testcycle, testgroup, priority
             else:
                 kwargs_to_pass[kwarg_key] = arg
 
-    df = json_to_df(get_data())
+    if chart_type == charts.FIG_TYPE_HISTORICAL_STATUS_LINE_CHART:
+        kwargs_to_pass['status_snapshots'] = get_status_snapshots(testplan)
+
+    df = get_plan_df(testplan)
     chart = get_chart(df, testplan, testcycle, testgroup, priority,
                       chart_type=chart_type,
                       week_ui=None,
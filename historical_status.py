@@ -16,6 +16,7 @@ Parameters:
     colormap (dict): The colors to use for the statuses
     treat_blocked_as_not_run (bool): Whether or not to treat blocked as not run
     treat_inprogress_as_not_run (bool): Whether or not to treat in progress runs as not run
+    status_snapshots (dataframe): The daily status snapshots of the test plan, or None
 
 Returns:
     data (list): Traces for each status over time
@@ -24,9 +25,10 @@ def get_historical_status_line_traces(
         df, testcycle, testgroup, priority,
         start_date, test_deadline, colormap,
         treat_blocked_as_not_run=False,
-        treat_inprogress_as_not_run=False):
+        treat_inprogress_as_not_run=False,
+        status_snapshots=None):
     df1 = get_testrun_status_historical(df, testcycle_key=testcycle, testgroup_key=testgroup, priority_key=priority,
-                                              start_date=start_date)
+                                              start_date=start_date, snapshots=status_snapshots)
     if df1 is None:
         return []
 
@@ -88,6 +90,7 @@ Parameters:
     testgroup (string): The test group
     priority (string): The priority
     colormap (dict): The colors to use for each status
+    status_snapshots (dataframe): The daily status snapshots of the test plan, optional
 
 Returns:
     fig: The line chart
@@ -117,7 +120,8 @@ def get_historical_status_line_chart(df, testcycle, testgroup, priority, title,
     traces = get_historical_status_line_traces(df, testcycle, testgroup, priority,
         start_date, test_deadline, colormap,
         treat_blocked_as_not_run,
-        treat_inprogress_as_not_run)
+        treat_inprogress_as_not_run,
+        status_snapshots=kwargs.get('status_snapshots'))
 
     fig = dict(data=traces)
     return fig
@@ -0,0 +1,164 @@
+import asyncio
+from jama_client import jama_client
+import jama_session
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+PAGE_SIZE = 50  # the Jama API returns at most 50 results per page
+
+
+'''Jama client that downloads test plans, test cycles, test runs and users as concurrent coroutines
+
+The metadata lookups are done by the synchronous connect() of jama_client. retrieve_all_testruns()
+then downloads every requested test plan on one event loop, with at most max_requests requests in
+flight, and stores the results so that retrieve_testruns() returns them from the cache.
+'''
+class jama_async_client(jama_client):
+    def __init__(self, blocking_as_not_run=False, inprogress_as_not_run=False, max_requests=20):
+        if aiohttp is None:
+            raise ImportError('The async Jama engine requires the aiohttp package')
+        super().__init__(blocking_as_not_run=blocking_as_not_run, inprogress_as_not_run=inprogress_as_not_run,
+                         max_requests=max_requests)
+
+    '''Sends a GET request to the Jama REST API, retrying on 429 and 5xx responses
+
+    Parameters:
+        session (ClientSession): The aiohttp session
+        semaphore (Semaphore): Limits the number of requests in flight
+        resource (string): The resource path under /rest/latest/
+        params (dict): The query parameters
+
+    Returns:
+        resp_json (dict): The decoded response
+    '''
+    async def __get(self, session, semaphore, resource, params=None):
+        url = self.url + '/rest/latest/' + resource
+        for attempt in range(jama_session.DEFAULT_RETRIES + 1):
+            async with semaphore:
+                async with session.get(url, params=params, ssl=None if self.ssl else False) as response:
+                    if response.status not in jama_session.RETRY_STATUS_CODES \
+                            or attempt == jama_session.DEFAULT_RETRIES:
+                        response.raise_for_status()
+                        return await response.json()
+            await asyncio.sleep(jama_session.DEFAULT_BACKOFF_FACTOR * (2 ** attempt))
+
+    '''Gets all the results of a paged Jama resource
+
+    The first page gives the total number of results, the remaining pages are then
+    requested at the same time.
+
+    Parameters:
+        session (ClientSession): The aiohttp session
+        semaphore (Semaphore): Limits the number of requests in flight
+        resource (string): The resource path under /rest/latest/
+        params (dict): The query parameters
+
+    Returns:
+        data (list): The results of all pages in order
+    '''
+    async def __get_all(self, session, semaphore, resource, params=None):
+        params = dict(params or {}, maxResults=PAGE_SIZE)
+        first = await self.__get(session, semaphore, resource, dict(params, startAt=0))
+        total = first['meta']['pageInfo'].get('totalResults', 0)
+        pages = await asyncio.gather(*[self.__get(session, semaphore, resource, dict(params, startAt=start))
+                                       for start in range(PAGE_SIZE, total, PAGE_SIZE)])
+        data = first.get('data', [])
+        for page in pages:
+            data += page.get('data', [])
+        return data
+
+    '''Gets the ID of a testplan given its name, using the cached ID if possible'''
+    async def __get_testplan_id(self, session, semaphore, project_id, testplan_key):
+        testplan_id = self.testplan_id_lookup.get((project_id, testplan_key))
+        if testplan_id is not None:
+            return testplan_id
+        testplans = await self.__get_all(session, semaphore, 'abstractitems',
+                                         dict(project=project_id, itemType=self.testplan_type,
+                                              contains=testplan_key))
+        if len(testplans) == 0:
+            print('Error: Cannot find a testplan with name {}'.format(testplan_key))
+            return None
+        exact = [x for x in testplans if x['fields'].get('name') == testplan_key]
+        testplan_id = exact[0]['id'] if len(exact) > 0 else testplans[0]['id']
+        self.testplan_id_lookup[(project_id, testplan_key)] = testplan_id
+        return testplan_id
+
+    '''Looks up the names of users that are not in the user lookup table yet'''
+    async def __load_users(self, session, semaphore, user_ids):
+        missing = [x for x in set(user_ids) if x is not None and x not in self.user_id_lookup]
+
+        async def get_user(user_id):
+            try:
+                data = (await self.__get(session, semaphore, 'users/{}'.format(user_id))).get('data')
+            except Exception as err:
+                print(f'Error looking up user {user_id} - {err}')
+                data = None
+            self.user_id_lookup[user_id] = data['firstName'] + ' ' + data['lastName'] if data is not None else ''
+
+        await asyncio.gather(*[get_user(x) for x in missing])
+
+    '''Downloads all testruns of a testplan and stores them in the testrun DB
+
+    Parameters:
+        session (ClientSession): The aiohttp session
+        semaphore (Semaphore): Limits the number of requests in flight
+        project_id (int): The ID of the project
+        testplan_key (string): The name of the testplan
+    '''
+    async def __retrieve_testplan(self, session, semaphore, project_id, testplan_key):
+        print('retrieving test runs for project {} and test plan {}...'.format(project_id, testplan_key))
+        testplan_id = await self.__get_testplan_id(session, semaphore, project_id, testplan_key)
+        if testplan_id is None:
+            return
+        tc = await self.__get_all(session, semaphore, 'testplans/{}/testcycles'.format(testplan_id))
+        if len(tc) == 0:
+            print('Error: Cannot find any test cycles under test plan {}'.format(testplan_key))
+            return
+        testcycles = [(x['id'], x['fields']['name']) for x in tc]
+        self.testcycle_db[(project_id, testplan_key)] = testcycles
+
+        cycle_testruns = await asyncio.gather(
+            *[self.__get_all(session, semaphore, 'testcycles/{}/testruns'.format(testcycle_id))
+              for (testcycle_id, _) in testcycles])
+        cycle_testruns = [self.project_testruns(x) for x in cycle_testruns]
+        await self.__load_users(session, semaphore,
+                                [y.get('fields', {}).get('assignedTo') for x in cycle_testruns for y in x])
+
+        self.update_modified_watermark(project_id, testplan_key, cycle_testruns)
+        testcycle_names = [testcycle_name for (_, testcycle_name) in testcycles]
+        new_df = self.testruns_to_df(project_id, testplan_key, zip(testcycle_names, cycle_testruns))
+        with self.testrun_db_lock:
+            self.testrun_db[(project_id, testplan_key)] = new_df
+
+    '''Downloads the testruns of several testplans at the same time
+
+    Parameters:
+        testplans (list): A list of (project id, testplan name) tuples
+    '''
+    async def retrieve_all_testruns_async(self, testplans):
+        semaphore = asyncio.Semaphore(self.max_requests)
+        auth = aiohttp.BasicAuth(self.username, self.password)
+        connector = aiohttp.TCPConnector(limit=self.max_requests)
+        async with aiohttp.ClientSession(auth=auth, connector=connector) as session:
+            results = await asyncio.gather(
+                *[self.__retrieve_testplan(session, semaphore, project_id, testplan_key)
+                  for (project_id, testplan_key) in testplans],
+                return_exceptions=True)
+        for (project_id, testplan_key), result in zip(testplans, results):
+            if isinstance(result, Exception):
+                print('Jama server connection ERROR for test plan {} - {}'.format(testplan_key, result))
+
+    '''Downloads the testruns of several testplans at the same time
+
+    Testplans that fail to download are left out of the testrun DB, so a following
+    retrieve_testruns() call retries them synchronously.
+
+    Parameters:
+        testplans (list): A list of (project id, testplan name) tuples
+    '''
+    def retrieve_all_testruns(self, testplans):
+        asyncio.run(self.retrieve_all_testruns_async(testplans))
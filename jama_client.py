@@ -1,8 +1,13 @@
 from py_jama_rest_client.client import JamaClient
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+import numpy as np
 import pandas as pd
 import requests
 import re
+import threading
+import jama_session
+import rest_client
 from requests.exceptions import HTTPError
 
 
@@ -23,6 +28,69 @@ COL_ASSIGNED_TO = 'assigned_to'
 COL_BUG_ID = 'bug_id'
 COL_TEST_NETWORK = 'test_network'
 COL_EXECUTION_METHOD = 'execution_method'
+COL_TESTRUN_ID = 'testrun_id'
+
+# Dataframe columns in order
+TESTRUN_COLUMNS = [
+    COL_PROJECT,
+    COL_TESTPLAN,
+    COL_TESTCYCLE,
+    COL_TESTGROUP,
+    COL_TESTRUN,
+    COL_PRIORITY,
+    COL_CREATED_DATE,
+    COL_MODIFIED_DATE,
+    COL_STATUS,
+    COL_EXECUTION_DATE,
+    COL_PLANNED_WEEK,
+    COL_ASSIGNED_TO,
+    COL_BUG_ID,
+    COL_NETWORK_TYPE,
+    COL_TEST_NETWORK,
+    COL_EXECUTION_METHOD,
+    COL_TESTRUN_ID
+]
+
+# Low-cardinality dataframe columns, stored as pandas categoricals
+CATEGORICAL_COLUMNS = [
+    COL_TESTPLAN,
+    COL_TESTCYCLE,
+    COL_TESTGROUP,
+    COL_STATUS,
+    COL_PRIORITY,
+    COL_PLANNED_WEEK,
+    COL_ASSIGNED_TO,
+    COL_NETWORK_TYPE,
+    COL_TEST_NETWORK,
+    COL_EXECUTION_METHOD
+]
+
+# Keys and standard fields of a Jama test run used to build the dataframe
+TESTRUN_KEYS = ['id', 'createdDate', 'modifiedDate', 'fields']
+TESTRUN_FIELDS = ['testRunSetName', 'name', 'testRunStatus', 'executionDate', 'assignedTo', 'testCycle']
+
+
+'''Converts the low-cardinality columns of a testrun dataframe to categoricals
+
+Frames concatenated from categoricals with different categories fall back to object columns,
+so this is applied again after every concat.
+
+Parameters:
+    df (dataframe): The test run data, converted in place
+    remove_unused (bool): Whether or not to drop the categories no row uses
+
+Returns:
+    df (dataframe): The test run data
+'''
+def to_categorical(df, remove_unused=False):
+    for col in CATEGORICAL_COLUMNS:
+        if col not in df.columns:
+            continue
+        if not pd.api.types.is_categorical_dtype(df[col]):
+            df[col] = df[col].astype('category')
+        elif remove_unused:
+            df[col] = df[col].cat.remove_unused_categories()
+    return df
 
 
 class jama_client:
@@ -30,6 +98,7 @@ class jama_client:
     username = None
     password = None
     testcycle_db = {}  # DB of test cycles for the projects and test plans we want to track
+    testplan_id_lookup = {}  # dict of (project, testplan name) to testplan id
     planned_weeks_lookup = {}  # dict of planned week id to name
     planned_weeks = [] # sorted list of start dates of planned weeks
     user_id_lookup = {} # dict of user ids to names
@@ -42,14 +111,15 @@ class jama_client:
     def __repr__(self):
         return f'{self.__class__.__name__})'
 
-    def __init__(self, blocking_as_not_run=False, inprogress_as_not_run=False):
-        # Test run DF columns
-        self.df_columns = ['project', 'testplan', 'testcycle', 'testrun',
-                           'created_date', 'modified_date', 'status']
-        # Test run DF
-        self.df = pd.DataFrame([], columns=self.df_columns)
-        self.df['created_date'] = pd.to_datetime(self.df['created_date'])
-        self.df['modified_date'] = pd.to_datetime(self.df['modified_date'])
+    def __init__(self, blocking_as_not_run=False, inprogress_as_not_run=False, max_workers=1, max_requests=None,
+                 checkpoint=None, unit_retries=2, page_size=rest_client.MAX_PAGE_SIZE,
+                 page_workers=rest_client.DEFAULT_PAGE_WORKERS):
+        # Test run DFs keyed by (project, testplan)
+        self.testrun_db = {}
+        # (modifiedDate watermark, dict of testcycle id to raw testruns) of the modified testruns, keyed by project
+        self.modified_testrun_db = {}
+        # dict of (project, testplan) to latest testrun modifiedDate
+        self.modified_watermarks = {}
         self.blocking_as_not_run = blocking_as_not_run
         self.inprogress_as_not_run = inprogress_as_not_run
         self.status_list = ['NOT_RUN', 'PASSED', 'FAILED']
@@ -57,6 +127,26 @@ class jama_client:
             self.status_list.append('INPROGRESS')
         if not blocking_as_not_run:
             self.status_list.append('BLOCKED')
+        # number of test cycles to fetch from Jama at the same time (1 = serial)
+        self.max_workers = max(1, max_workers)
+        # cap on the number of Jama requests in flight across all threads using this client. Each page of a
+        # paged listing holds a slot, so by default every test cycle worker can download page_workers pages
+        self.max_requests = max(1, max_requests if max_requests is not None
+                                else self.max_workers * max(1, page_workers))
+        self.request_slots = threading.BoundedSemaphore(self.max_requests)
+        # guards the cached test run DFs when several test plans are retrieved at the same time
+        self.testrun_db_lock = threading.Lock()
+        # optional store of completed test plan and test cycle downloads, used to resume a failed refresh
+        self.checkpoint = checkpoint
+        # number of times to retry downloading a single test cycle before giving up
+        self.unit_retries = unit_retries
+        # results per page and number of pages requested at the same time for paged listings
+        self.page_size = page_size
+        self.page_workers = page_workers
+        # cache of the Jama metadata given to connect(), and whether the metadata was downloaded again since
+        self.metadata_cache = None
+        self.metadata_refreshed = False
+        self.metadata_lock = threading.Lock()
 
     '''Query Jama for the user's name given an ID
     
@@ -68,7 +158,8 @@ class jama_client:
     '''
     def __get_user_info_from_jama(self, user_id):
         try:
-            response = requests.get(self.url + '/rest/latest/users/' + str(user_id), auth=(self.username, self.password), verify=self.ssl)
+            response = jama_session.get_session().get(self.url + '/rest/latest/users/' + str(user_id),
+                                                      auth=(self.username, self.password), verify=self.ssl)
             # If the response was successful, no Exception will be raised
             response.raise_for_status()
         except HTTPError as http_err:
@@ -108,6 +199,21 @@ class jama_client:
             self.user_id_lookup[user_id] = user
         return user
 
+    '''Loads the names of all users in Jama into the user lookup table
+
+    Users are paged through in bulk once, so that __get_user_from_id only needs
+    to query Jama for users that were not returned here.
+    '''
+    def __load_user_directory(self):
+        try:
+            users = self.client.get_users()
+        except Exception as err:
+            print('Error loading Jama user directory -', err)
+            return
+        for x in users:
+            self.user_id_lookup[x['id']] = x['firstName'] + ' ' + x['lastName']
+        print('loaded {} users from Jama'.format(len(users)))
+
     '''Gets the priority string from the ID
     
     Parameters:
@@ -117,7 +223,7 @@ class jama_client:
         The priority string
     '''
     def __get_priority_from_id(self, id):
-        return self.priority_id_lookup.get(id) if id is not None else 'Unassigned'
+        return self.__lookup(self.priority_id_lookup, id) if id is not None else 'Unassigned'
 
     '''Gets the network type string from the ID
     
@@ -128,7 +234,7 @@ class jama_client:
         The network type string
     '''
     def __get_network_type_from_id(self, id):
-        return self.network_type_id_lookup.get(id) if id is not None else 'Unassigned'
+        return self.__lookup(self.network_type_id_lookup, id) if id is not None else 'Unassigned'
 
     '''Gets the test network string from the ID
     
@@ -139,7 +245,7 @@ class jama_client:
         The test network string
     '''
     def __get_test_network_from_id(self, id):
-        return self.test_network_id_lookup.get(id) if id is not None else 'Unassigned'
+        return self.__lookup(self.test_network_id_lookup, id) if id is not None else 'Unassigned'
 
     '''Gets the execution method string from the ID
     
@@ -150,7 +256,151 @@ class jama_client:
         The execution method string
     '''
     def __get_execution_method_from_id(self, id):
-        return self.execution_method_id_lookup.get(id) if id is not None else 'Unassigned'
+        return self.__lookup(self.execution_method_id_lookup, id) if id is not None else 'Unassigned'
+
+    '''Gets the name of a pick list option from a lookup table
+
+    An option added in Jama after the metadata was cached is not in the lookup table yet. The
+    metadata is then downloaded again, once per client, before giving up on the option.
+
+    Parameters:
+        lookup (dict): The lookup table of pick list option ids to names
+        id (int): The ID of the option
+
+    Returns:
+        The name of the option, None if it cannot be found
+    '''
+    def __lookup(self, lookup, id):
+        name = lookup.get(id)
+        if name is None and id is not None and self.__refresh_metadata():
+            name = lookup.get(id)
+        return name
+
+    '''Downloads the metadata again, replacing the cached metadata
+
+    Returns:
+        True if the metadata was downloaded again by this or an earlier call
+    '''
+    def __refresh_metadata(self):
+        with self.metadata_lock:
+            if self.metadata_refreshed:
+                return True
+            self.metadata_refreshed = True
+            print('unknown pick list option, downloading the Jama metadata again')
+            try:
+                metadata = self.__retrieve_metadata()
+            except Exception as err:
+                print('Error downloading the Jama metadata -', err)
+                return False
+            if self.metadata_cache is not None:
+                self.metadata_cache.set(self.url, metadata)
+            self.__set_metadata(metadata)
+            return True
+
+    '''Calls the Jama client once a request slot is free
+
+    Parameters:
+        func (function): The JamaClient method to call
+        kwargs: The arguments for the method
+
+    Returns:
+        The result of the call
+    '''
+    def __request(self, func, **kwargs):
+        with self.request_slots:
+            return func(**kwargs)
+
+    '''Retrieves the item types, test run field names and pick list options from Jama
+
+    Returns:
+        metadata (dict): The metadata in a JSON serializable format
+    '''
+    def __retrieve_metadata(self):
+        metadata = {}
+
+        # get item types for test plans and cycles
+        item_types = self.client.get_item_types()
+        metadata['testplan_type'] = next(x for x in item_types if x['typeKey'] == 'TSTPL')['id']
+        metadata['testcycle_type'] = next(x for x in item_types if x['typeKey'] == 'TSTCY')['id']
+        testrun_obj = next(x for x in item_types if x['typeKey'] == 'TSTRN')
+        metadata['testrun_type'] = testrun_obj['id']
+
+        # find the IDs for fields in a test run
+        pick_lists = self.client.get_pick_lists()
+        planned_week_id = next(x for x in pick_lists if x['name'] == 'Planned week')['id']
+        priority_id = next(x for x in pick_lists if x['name'] == 'Priority')['id']
+        network_type_id = next(x for x in pick_lists if x['name'] == 'Network')['id']
+        test_network_id = next(x for x in pick_lists if x['name'] == 'Test Network')['id']
+        execution_method_id = next(x for x in pick_lists if x['name'] == 'Execution Method')['id']
+
+        # find the names for the fields in a test run
+        field_names = dict.fromkeys(['bug_id', 'priority', 'network_type', 'planned_week',
+                                     'test_network', 'execution_method'])
+        for x in testrun_obj['fields']:
+            if 'label' in x:
+                if x['label'] == 'Bug ID':
+                    field_names['bug_id'] = x['name']
+                    continue
+                if x['label'] == 'Priority':
+                    field_names['priority'] = x['name']
+                    continue
+                if x['label'] == 'Network Type':
+                    field_names['network_type'] = x['name']
+                    continue
+                if x['label'] == 'Test Network':
+                    field_names['test_network'] = x['name']
+                    continue
+                if x['label'] == 'Test Execution Method':
+                    field_names['execution_method'] = x['name']
+                    continue
+            if 'pickList' in x and x['pickList'] == planned_week_id:
+                field_names['planned_week'] = x['name']
+                continue
+        metadata['field_names'] = field_names
+
+        # get the pick list options as [id, name] pairs, since JSON object keys cannot be ints
+        get_options = lambda pick_list_id: [[x['id'], x['name']] for x in self.client.get_pick_list_options(pick_list_id)]
+        metadata['planned_weeks'] = get_options(planned_week_id)
+        metadata['priorities'] = get_options(priority_id)
+        metadata['network_types'] = get_options(network_type_id)
+        metadata['test_networks'] = get_options(test_network_id)
+        metadata['execution_methods'] = get_options(execution_method_id)
+        return metadata
+
+    '''Sets up the item types, field names and lookup tables from Jama metadata
+
+    Parameters:
+        metadata (dict): The metadata returned by __retrieve_metadata
+    '''
+    def __set_metadata(self, metadata):
+        self.testplan_type = metadata['testplan_type']
+        self.testcycle_type = metadata['testcycle_type']
+        self.testrun_type = metadata['testrun_type']
+
+        # names for the fields in a test run
+        field_names = metadata['field_names']
+        self.bug_id_field_name = field_names['bug_id']
+        self.priority_field_name = field_names['priority']
+        self.network_type_field_name = field_names['network_type']
+        self.planned_week_field_name = field_names['planned_week']
+        self.test_network_field_name = field_names['test_network']
+        self.execution_method_field_name = field_names['execution_method']
+        # the test run fields used to build the dataframe, all other fields are dropped on download
+        self.testrun_field_names = set(TESTRUN_FIELDS + [x for x in field_names.values() if x is not None])
+
+        # create week lookup table
+        planned_weeks = []
+        for (week_id, week) in metadata['planned_weeks']:
+            self.planned_weeks_lookup[week_id] = week
+            planned_weeks.append(week)
+        # Add None to the list for tests with unassigned weeks
+        self.planned_weeks = [None] + sorted(planned_weeks)
+
+        # create priority, network type, test network and execution method lookup tables
+        self.priority_id_lookup.update(metadata['priorities'])
+        self.network_type_id_lookup.update(metadata['network_types'])
+        self.test_network_id_lookup.update(metadata['test_networks'])
+        self.execution_method_id_lookup.update(metadata['execution_methods'])
 
     '''Initializes the client connection
 
@@ -158,86 +408,30 @@ class jama_client:
         url (string): The base URL of the Jama instance
         username (string): The username for the Jama login
         password (string): The password for the Jama login
+        ssl_verify (bool): Whether or not to use SSL verification accessing the API
+        prefetch_users (bool): Whether or not to load all user names up front
+        metadata_cache (jama_metadata_cache): Cache for the item types and pick lists, or None
     '''
-    def connect(self, url, username, password, ssl_verify=True):
+    def connect(self, url, username, password, ssl_verify=True, prefetch_users=True, metadata_cache=None):
         # Create the Jama client
         try:
             self.ssl=ssl_verify
             self.client = JamaClient(host_domain=url, credentials=(username, password), verify=self.ssl)
-
-            # get item types for test plans and cycles
-            self.item_types = self.client.get_item_types()
-            self.testplan_type = next(x for x in self.item_types if x['typeKey'] == 'TSTPL')['id']
-            self.testcycle_type = next(x for x in self.item_types if x['typeKey'] == 'TSTCY')['id']
-            self.testrun_obj = next(x for x in self.item_types if x['typeKey'] == 'TSTRN')
-
-            # names for the fields in a test run
-            self.bug_id_field_name = None
-            self.priority_field_name = None
-            self.network_type_field_name = None
-            self.planned_week_field_name = None
-            self.test_network_field_name = None
-            self.execution_method_field_name = None
-
-            # find the IDs for fields in a test run
-            pick_lists = self.client.get_pick_lists()
-            planned_week_id = next(x for x in pick_lists if x['name'] == 'Planned week')['id']
-            priority_id = next(x for x in pick_lists if x['name'] == 'Priority')['id']
-            network_type_id = next(x for x in pick_lists if x['name'] == 'Network')['id']
-            test_network_id = next(x for x in pick_lists if x['name'] == 'Test Network')['id']
-            execution_method_id = next(x for x in pick_lists if x['name'] == 'Execution Method')['id']
-
-            # find the names for the fields in a test run
-            for x in self.testrun_obj['fields']:
-                if 'label' in x:
-                    if x['label'] == 'Bug ID':
-                        self.bug_id_field_name = x['name']
-                        continue
-                    if x['label'] == 'Priority':
-                        self.priority_field_name = x['name']
-                        continue
-                    if x['label'] == 'Network Type':
-                        self.network_type_field_name = x['name']
-                        continue
-                    if x['label'] == 'Test Network':
-                        self.test_network_field_name = x['name']
-                        continue
-                    if x['label'] == 'Test Execution Method':
-                        self.execution_method_field_name = x['name']
-                        continue
-                if 'pickList' in x and x['pickList'] == planned_week_id:
-                    self.planned_week_field_name = x['name']
-                    continue
-
-            # create week lookup table
-            weeks = self.client.get_pick_list_options(planned_week_id)
-            for x in weeks:
-                week = x['name']
-                self.planned_weeks_lookup[x['id']] = week
-                self.planned_weeks.append(week)
-            self.planned_weeks = sorted(self.planned_weeks)
-            # Add None to the list for tests with unassigned weeks
-            self.planned_weeks = [None] + self.planned_weeks
-
-            # create priority lookup table
-            priorities = self.client.get_pick_list_options(priority_id)
-            for x in priorities:
-                self.priority_id_lookup[x['id']] = x['name']
-
-            # create network type lookup table
-            network_types = self.client.get_pick_list_options(network_type_id)
-            for x in network_types:
-                self.network_type_id_lookup[x['id']] = x['name']
-
-            # create test network lookup table
-            test_networks = self.client.get_pick_list_options(test_network_id)
-            for network in test_networks:
-                self.test_network_id_lookup[network['id']] = network['name']
-
-            # create execution method lookup table
-            execution_methods = self.client.get_pick_list_options(execution_method_id)
-            for method in execution_methods:
-                self.execution_method_id_lookup[method['id']] = method['name']
+            # share pooled connections with the other Jama callers
+            jama_session.attach(self.client)
+
+            # get item types, field names and pick list options, from the cache if possible
+            self.metadata_cache = metadata_cache
+            metadata = metadata_cache.get(url) if metadata_cache is not None else None
+            if metadata is None:
+                metadata = self.__retrieve_metadata()
+                if metadata_cache is not None:
+                    metadata_cache.set(url, metadata)
+            self.__set_metadata(metadata)
+
+            # create user lookup table
+            if prefetch_users:
+                self.__load_user_directory()
 
         except requests.exceptions.ConnectionError as err:
             print('Jama server connection ERROR! -', err)
@@ -247,6 +441,41 @@ class jama_client:
         self.url = url
         return True
 
+    '''Gets the ID of a testplan given its name
+
+    Parameters:
+        project_id (int): The ID of the project
+        testplan_key (string): The name of the testplan
+
+    Returns:
+        testplan_id (int): The ID of the testplan, or None if it cannot be found
+
+    Raises:
+        Exception: The search request failed
+    '''
+    def __get_testplan_id(self, project_id, testplan_key):
+        testplan_id = self.testplan_id_lookup.get((project_id, testplan_key))
+        if testplan_id is not None:
+            return testplan_id
+
+        #print(f'querying for test plan {testplan_key}...')
+        # search the test plans in project
+        testplans = self.__request(self.client.get_abstract_items,
+                                   item_type=self.testplan_type,
+                                   project=project_id,
+                                   contains=testplan_key)
+
+        if len(testplans) == 0:
+            print('Error: Cannot find a testplan with name {}'.format(testplan_key))
+            return None
+        # we will assume that within a project, Jama only allows you to create testplans with unique names,
+        # but the search also matches testplans that contain the name
+        exact = [x for x in testplans if x['fields'].get('name') == testplan_key]
+        testplan_id = exact[0]['id'] if len(exact) > 0 else testplans[0]['id']
+        print('found test plan {}!'.format(testplan_key))
+        self.testplan_id_lookup[(project_id, testplan_key)] = testplan_id
+        return testplan_id
+
     '''Gets a list of testcycles in a given project and testplan
 
     Parameters:
@@ -254,40 +483,37 @@ class jama_client:
         testplan_key (string): The name of the testplan
     
     Returns:
-        testcycles (list): A list of testcycles in the testplan
+        testcycles (list): A list of testcycles in the testplan, or None if the testplan has none
+
+    Raises:
+        Exception: A request to Jama failed
     '''
     def retrieve_testcycles(self, project_id, testplan_key, update=False):
         testcycles = self.testcycle_db.get((project_id, testplan_key))
         if not update and self.testcycle_db is not None and testcycles is not None:
             return testcycles
 
-        #print(f'querying for test plan {testplan_key}...')
-        # get all test plans in project
-        try:
-            testplans = self.client.get_abstract_items(item_type=self.testplan_type,
-                                                       project=project_id,
-                                                       contains=testplan_key)
-        except Exception as err:
-            print('Jama server connection ERROR! -', err)
-            return None
+        # resume from the test cycles found by a previous refresh attempt
+        if not update and self.checkpoint is not None:
+            testcycles = self.checkpoint.get_testcycles(project_id, testplan_key)
+            if testcycles is not None:
+                self.testcycle_db[(project_id, testplan_key)] = testcycles
+                return testcycles
 
-        if len(testplans) == 0:
-            print('Error: Cannot find a testplan with name {}'.format(testplan_key))
+        testplan_id = self.__get_testplan_id(project_id, testplan_key)
+        if testplan_id is None:
             return None
-        # we will assume that within a project, Jama only allows you to create testplans with unique names
-        testplan_id = testplans[0]['id']
-        print('found test plan {}!'.format(testplan_key))
         #print('querying for test cycles under test plan {}...'.format(testplan_key))
-        # get all test cycles in project
-        try:
-            tc = self.client.get_abstract_items(item_type=self.testcycle_type,
-                                                project=project_id)  # contains='GX5_P1S1F2-DR_IQ800_Datapath'
-        except Exception as err:
-            print('Jama server connection ERROR! -', err)
-            return None
+        # get the test cycles of our test plan only
+        tc = rest_client.get_testplan_testcycles(url=self.url,
+                                                 testplan_id=testplan_id,
+                                                 username=self.username,
+                                                 password=self.password,
+                                                 ssl_verify=self.ssl,
+                                                 page_size=self.page_size,
+                                                 max_workers=self.page_workers,
+                                                 request_slots=self.request_slots)
 
-        # remove test cycles that do not belong to our test plan
-        tc = [x for x in tc if x['fields']['testPlan'] == testplan_id]
         if len(tc) == 0:
             print('Error: Cannot find any test cycles under test plan {}'.format(testplan_key))
             return None
@@ -296,8 +522,259 @@ class jama_client:
         # we just need test cycle id and name for our purposes
         testcycles = [(x['id'], x['fields']['name']) for x in tc]
         self.testcycle_db[(project_id, testplan_key)] = testcycles
+        if self.checkpoint is not None:
+            self.checkpoint.set_testcycles(project_id, testplan_key, testcycles)
         return testcycles
 
+    '''Strips raw testruns down to the keys and fields used to build the dataframe
+
+    The Jama API has no way to select fields, so the step results and other large
+    fields are dropped as soon as a testrun is downloaded, before it is kept in memory
+    or checkpointed.
+
+    Parameters:
+        testruns_raw (list): The raw testruns
+
+    Returns:
+        testruns (list): The stripped testruns
+    '''
+    def project_testruns(self, testruns_raw):
+        testruns = []
+        for y in testruns_raw:
+            testrun = {k: y[k] for k in TESTRUN_KEYS if k in y}
+            fields = y.get('fields')
+            if fields is not None:
+                testrun['fields'] = {k: v for k, v in fields.items() if k in self.testrun_field_names}
+            testruns.append(testrun)
+        return testruns
+
+    '''Gets the raw testruns of a testcycle
+
+    The testruns are taken from the checkpoint if a previous refresh attempt already
+    downloaded them. Otherwise the download is retried up to unit_retries times and
+    the result is checkpointed.
+
+    Parameters:
+        testcycle_id (int): The ID of the testcycle
+
+    Returns:
+        testruns_raw (list): The raw testruns
+    '''
+    def __fetch_testruns_for_testcycle(self, testcycle_id):
+        if self.checkpoint is not None:
+            testruns_raw = self.checkpoint.get_testruns(testcycle_id)
+            if testruns_raw is not None:
+                return testruns_raw
+        for attempt in range(self.unit_retries + 1):
+            try:
+                testruns_raw = self.project_testruns(
+                    rest_client.get_testcycle_testruns(url=self.url,
+                                                       testcycle_id=testcycle_id,
+                                                       username=self.username,
+                                                       password=self.password,
+                                                       ssl_verify=self.ssl,
+                                                       page_size=self.page_size,
+                                                       max_workers=self.page_workers,
+                                                       request_slots=self.request_slots))
+                break
+            except Exception as err:
+                if attempt == self.unit_retries:
+                    raise
+                print(f'Error retrieving test runs of test cycle {testcycle_id}, retrying - {err}')
+        if self.checkpoint is not None:
+            self.checkpoint.set_testruns(testcycle_id, testruns_raw)
+        return testruns_raw
+
+    '''Gets the raw testruns for each of the given testcycles
+
+    Up to max_workers test cycles are fetched from Jama at the same time. The
+    results are returned in the same order as the testcycles list regardless of
+    the order in which the requests complete.
+
+    Parameters:
+        testcycles (list): A list of (testcycle id, testcycle name) tuples
+
+    Returns:
+        cycle_testruns (list): A list with the list of raw testruns for each testcycle
+
+    Raises:
+        Exception: A testcycle could not be downloaded after unit_retries retries
+    '''
+    def __fetch_testruns_for_testcycles(self, testcycles):
+        testcycle_ids = [testcycle_id for (testcycle_id, _) in testcycles]
+        get_testruns = self.__fetch_testruns_for_testcycle
+        if self.max_workers == 1 or len(testcycle_ids) < 2:
+            return [get_testruns(x) for x in testcycle_ids]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(testcycle_ids))) as executor:
+            # map() yields the results in the order of the input ids
+            return list(executor.map(get_testruns, testcycle_ids))
+
+    '''Converts raw Jama testruns to a testrun dataframe
+
+    Parameters:
+        project_id (int): The ID of the project
+        testplan_key (string): The name of the testplan
+        cycle_testruns (iterable): (testcycle name, list of raw testruns) tuples
+
+    Returns:
+        new_df (dataframe): A dataframe with one row per testrun
+    '''
+    def testruns_to_df(self, project_id, testplan_key, cycle_testruns):
+        # append each value straight into its column instead of building a list per row
+        columns = {col: [] for col in TESTRUN_COLUMNS}
+        for testcycle_name, testruns_raw in cycle_testruns:
+            # Get all the data for each test run
+            for y in testruns_raw:
+                fields = y.get('fields')
+                if fields is None:
+                    continue
+
+                planned_week = None
+                if self.planned_week_field_name is not None and self.planned_week_field_name in fields:
+                    planned_week = self.__lookup(self.planned_weeks_lookup, fields[self.planned_week_field_name])
+
+                bug_id = None
+                if self.bug_id_field_name is not None:
+                    bug_id = fields.get(self.bug_id_field_name)
+
+                columns[COL_PROJECT].append(project_id)
+                columns[COL_TESTPLAN].append(testplan_key)
+                columns[COL_TESTCYCLE].append(testcycle_name)
+                columns[COL_TESTGROUP].append(fields.get('testRunSetName'))
+                columns[COL_TESTRUN].append(fields.get('name'))
+                columns[COL_PRIORITY].append(self.__get_priority_from_id(fields.get(self.priority_field_name)))
+                columns[COL_CREATED_DATE].append(y.get('createdDate'))
+                columns[COL_MODIFIED_DATE].append(y.get('modifiedDate'))
+                columns[COL_STATUS].append(fields.get('testRunStatus'))
+                columns[COL_EXECUTION_DATE].append(fields.get('executionDate'))
+                columns[COL_PLANNED_WEEK].append(planned_week)
+                columns[COL_ASSIGNED_TO].append(self.__get_user_from_id(fields.get('assignedTo')))
+                columns[COL_BUG_ID].append(bug_id)
+                columns[COL_NETWORK_TYPE].append(
+                    self.__get_network_type_from_id(fields.get(self.network_type_field_name)))
+                columns[COL_TEST_NETWORK].append(
+                    self.__get_test_network_from_id(fields.get(self.test_network_field_name)))
+                columns[COL_EXECUTION_METHOD].append(
+                    self.__get_execution_method_from_id(fields.get(self.execution_method_field_name)))
+                columns[COL_TESTRUN_ID].append(y.get('id'))
+
+        print('found {} test runs!'.format(len(columns[COL_TESTRUN_ID])))
+
+        # Jama dates start with YYYY-MM-DD, which numpy parses directly into dates (None becomes NaT)
+        for col in [COL_CREATED_DATE, COL_MODIFIED_DATE, COL_EXECUTION_DATE]:
+            columns[col] = np.array([x[:10] if x is not None else None for x in columns[col]], dtype='datetime64[D]')
+        new_df = pd.DataFrame(columns, columns=TESTRUN_COLUMNS)
+        return to_categorical(new_df)
+
+    '''Records the latest modifiedDate seen in a testplan's raw testruns
+
+    Parameters:
+        project_id (int): The ID of the project
+        testplan_key (string): The name of the testplan
+        cycle_testruns (list): A list with the list of raw testruns for each testcycle
+    '''
+    def update_modified_watermark(self, project_id, testplan_key, cycle_testruns):
+        # Jama returns modifiedDate as a fixed format ISO string, so the strings sort by time
+        modified = [y['modifiedDate'] for testruns_raw in cycle_testruns for y in testruns_raw
+                    if y.get('modifiedDate') is not None]
+        watermark = self.modified_watermarks.get((project_id, testplan_key))
+        if watermark is not None:
+            modified.append(watermark)
+        if len(modified) > 0:
+            self.modified_watermarks[(project_id, testplan_key)] = max(modified)
+
+    '''Gets the latest modifiedDate of the testruns retrieved for a testplan
+
+    Parameters:
+        project_id (int): The ID of the project
+        testplan_key (string): The name of the testplan
+
+    Returns:
+        watermark (string): The modifiedDate in Jama format, or None if no testruns were retrieved
+    '''
+    def get_modified_watermark(self, project_id, testplan_key):
+        return self.modified_watermarks.get((project_id, testplan_key))
+
+    '''Downloads the testruns in a project that were modified since a given time
+
+    The project is queried once for all of its testplans, with the pages requested at the
+    same time. The testruns are kept grouped by testcycle for retrieve_modified_testruns.
+
+    Parameters:
+        project_id (int): The ID of the project
+        since (string): The oldest modifiedDate watermark of the project's testplans, in Jama format
+
+    Raises:
+        Exception: A request to Jama failed
+    '''
+    def retrieve_modified_project_testruns(self, project_id, since):
+        print('retrieving test runs modified since {} for project {}...'.format(since, project_id))
+        testruns_raw = self.project_testruns(
+            rest_client.get_all_pages(self.url, 'abstractitems', self.username, self.password, self.ssl,
+                                      params=dict(project=project_id, itemType=self.testrun_type,
+                                                  modifiedDate=[since]),
+                                      page_size=self.page_size, max_workers=self.page_workers,
+                                      request_slots=self.request_slots))
+        print('found {} modified test runs in project {}!'.format(len(testruns_raw), project_id))
+        testcycle_runs = {}
+        for y in testruns_raw:
+            testcycle_runs.setdefault(y.get('fields', {}).get('testCycle'), []).append(y)
+        with self.testrun_db_lock:
+            self.modified_testrun_db[project_id] = (since, testcycle_runs)
+
+    '''Gets the testruns in a testplan that were modified since a given time
+
+    Only testruns modified since the watermark are downloaded. Deleted testruns are not
+    reported, so callers should still do a full retrieve_testruns from time to time.
+    The testruns are taken from the last retrieve_modified_project_testruns of the project
+    if it started at or before the watermark, the project is queried otherwise.
+
+    Parameters:
+        project_id (int): The ID of the project
+        testplan_key (string): The name of the testplan
+        since (string): The modifiedDate watermark in Jama format
+
+    Returns:
+        new_df (dataframe): The modified testruns, or None if the testplan cannot be found
+
+    Raises:
+        Exception: A request to Jama failed
+    '''
+    def retrieve_modified_testruns(self, project_id, testplan_key, since):
+        print('retrieving test runs modified since {} for project {} and test plan {}...'
+              .format(since, project_id, testplan_key))
+        testcycles = self.retrieve_testcycles(project_id=project_id, testplan_key=testplan_key)
+        if testcycles is None:
+            print(f'invalid testplan {testplan_key}')
+            return None
+        with self.testrun_db_lock:
+            modified = self.modified_testrun_db.get(project_id)
+        if modified is None or modified[0] > since:
+            self.retrieve_modified_project_testruns(project_id, since)
+            with self.testrun_db_lock:
+                modified = self.modified_testrun_db.get(project_id)
+        testcycle_runs = modified[1]
+
+        # keep the testruns of our test cycles modified since our own watermark, the project may
+        # have been queried from an older one. Jama modifiedDate strings sort by time.
+        cycle_testruns = [[y for y in testcycle_runs.get(testcycle_id, []) if (y.get('modifiedDate') or '') >= since]
+                          for (testcycle_id, _) in testcycles]
+        self.update_modified_watermark(project_id, testplan_key, cycle_testruns)
+        testcycle_names = [testcycle_name for (_, testcycle_name) in testcycles]
+        return self.testruns_to_df(project_id, testplan_key, zip(testcycle_names, cycle_testruns))
+
+    '''Gets all the testruns retrieved so far
+
+    Returns:
+        df (dataframe): The testruns of every retrieved testplan, or None if nothing was retrieved
+    '''
+    def get_dataset(self):
+        with self.testrun_db_lock:
+            frames = list(self.testrun_db.values())
+        if len(frames) == 0:
+            return None
+        return pd.concat(frames)
+
     '''Gets a list of testruns in a given project, testplan, and testcycle
 
     Parameters:
@@ -306,109 +783,38 @@ class jama_client:
         testcycle_key (string): The name of the testcycle
     
     Returns:
-        new_df (JSON): A JSON containing all the testruns
+        new_df (JSON): A JSON containing all the testruns, or None if the testplan cannot be found
+
+    Raises:
+        Exception: A request to Jama failed
     '''
     def retrieve_testruns(self, project_id, testplan_key, testcycle_key=None, update=False):
         # check for cached test run data
-        if not self.df.empty:
-            print('checking cached test runs for project {} and test plan {}{}...'
-                  .format(project_id, testplan_key,
-                          '' if testcycle_key is None else ' and test cycle {}'.format(testcycle_key)))
-            query_df = self.df[self.df.project.isin([project_id]) & self.df.testplan.isin([testplan_key])]
-            if not query_df.empty and testcycle_key is not None:
+        with self.testrun_db_lock:
+            cached_df = self.testrun_db.get((project_id, testplan_key))
+        if cached_df is not None and not update:
+            print('{} cached test runs found for project {} and test plan {}!'
+                  .format(cached_df.shape[0], project_id, testplan_key))
+            if testcycle_key is not None:
                 # filter by test cycle key
-                query_df = query_df[query_df.testcycle.isin([testcycle_key])]
-            if not query_df.empty:
-                print('{} cached test runs found!'.format(query_df.shape[0]))
-                if update == False:
-                    # return cached test runs
-                    return query_df
-                else:
-                    print('removing cached test runs to prepare for update...')
-                    # remove any cached runs for this test plan
-                    self.df = self.df[~self.df.testplan.eq(testplan_key)]
+                cached_df = cached_df[cached_df.testcycle.eq(testcycle_key)]
+            # return cached test runs
+            return cached_df
 
         print('retrieving test runs for project {} and test plan {}...'.format(project_id, testplan_key))
         testcycles = self.retrieve_testcycles(project_id=project_id, testplan_key=testplan_key)
         if testcycles is None:
             print(f'invalid testplan {testplan_key}')
             return None
-        testruns_to_add = []
-        for (testcycle_id, testcycle_name) in testcycles:
-            try:
-                testruns_raw = self.client.get_testruns(test_cycle_id=testcycle_id)
-            except Exception as err:
-                print('Jama server connection ERROR! -', err)
-                return None
-
-            # Get all the data for each test run
-            for y in testruns_raw:
-                planned_week = None
-                if self.planned_week_field_name is not None and self.planned_week_field_name in y['fields']:
-                    week_id = y['fields'][self.planned_week_field_name]
-                    if week_id in self.planned_weeks_lookup:
-                        planned_week = self.planned_weeks_lookup[week_id]
-
-                bug_id = None
-                if self.bug_id_field_name is not None:
-                    bug_id = y['fields'].get(self.bug_id_field_name)
-
-                fields = y.get('fields')
-                if fields is None:
-                    continue
-
-                user = self.__get_user_from_id(fields.get('assignedTo'))
-                priority = self.__get_priority_from_id(fields.get(self.priority_field_name))
-                network_type = self.__get_network_type_from_id(fields.get(self.network_type_field_name))
-                test_network = self.__get_test_network_from_id(fields.get(self.test_network_field_name))
-                execution_method = self.__get_execution_method_from_id(fields.get(self.execution_method_field_name))
-                
-                row = [project_id,
-                       testplan_key,
-                       testcycle_name,
-                       fields.get('testRunSetName'),
-                       fields.get('name'),
-                       priority,
-                       y.get('createdDate'),
-                       y.get('modifiedDate'),
-                       fields.get('testRunStatus'),
-                       fields.get('executionDate'),
-                       planned_week,
-                       user,
-                       bug_id,
-                       network_type,
-                       test_network,
-                       execution_method]
-                testruns_to_add.append(row)
-
-        print('found {} test runs!'.format(len(testruns_to_add)))
-
-        # append the retrieved test runs to the existing data frame
-        new_df = pd.DataFrame(
-            testruns_to_add,
-            columns=[
-                COL_PROJECT, 
-                COL_TESTPLAN, 
-                COL_TESTCYCLE, 
-                COL_TESTGROUP, 
-                COL_TESTRUN, 
-                COL_PRIORITY,
-                COL_CREATED_DATE, 
-                COL_MODIFIED_DATE, 
-                COL_STATUS, 
-                COL_EXECUTION_DATE,
-                COL_PLANNED_WEEK, 
-                COL_ASSIGNED_TO, 
-                COL_BUG_ID, 
-                COL_NETWORK_TYPE, 
-                COL_TEST_NETWORK, 
-                COL_EXECUTION_METHOD
-            ]
-        )
-        new_df['created_date'] = pd.to_datetime(new_df['created_date'], format="%Y-%m-%d").dt.date
-        new_df['modified_date'] = pd.to_datetime(new_df['modified_date'], format="%Y-%m-%d").dt.date
-        new_df['execution_date'] = pd.to_datetime(new_df['execution_date'], format="%Y-%m-%d").dt.date
-        self.df = self.df.append(new_df, sort=False)
+        # a testcycle that cannot be downloaded fails the whole testplan, so that it is not left out of the dataset
+        cycle_testruns = self.__fetch_testruns_for_testcycles(testcycles)
+        self.update_modified_watermark(project_id, testplan_key, cycle_testruns)
+        testcycle_names = [testcycle_name for (_, testcycle_name) in testcycles]
+        new_df = self.testruns_to_df(project_id, testplan_key, zip(testcycle_names, cycle_testruns))
+
+        # store the retrieved test runs, replacing any cached runs for this test plan
+        with self.testrun_db_lock:
+            self.testrun_db[(project_id, testplan_key)] = new_df
 
         if testcycle_key is not None:
             # filter by test cycle key
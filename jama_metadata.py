@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import sys
+import time
+from os.path import expanduser, isfile
+
+
+DEFAULT_CACHE_PATH = expanduser('~') + '/.jama-metadata-cache.json'
+DEFAULT_TTL = 86400  # seconds
+
+
+'''Local disk cache for the Jama item types, test run field names and pick list options
+
+The metadata is stored per Jama URL in a JSON file together with the time it was
+retrieved. Entries older than the TTL are treated as missing.
+'''
+class jama_metadata_cache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+    '''Reads all the cache entries from disk'''
+    def __read(self):
+        if not isfile(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except Exception as e:
+            print(f'Error reading metadata cache {self.path} - {e}')
+            return {}
+
+    '''Writes all the cache entries to disk'''
+    def __write(self, entries):
+        # write to a temporary file first so that readers never see a partial file
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f'Error writing metadata cache {self.path} - {e}')
+
+    '''Gets the cached metadata for a Jama instance
+
+    Parameters:
+        url (string): The base URL of the Jama instance
+
+    Returns:
+        metadata (dict): The cached metadata, or None if missing or expired
+    '''
+    def get(self, url):
+        entry = self.__read().get(url)
+        if entry is None or time.time() - entry['time'] >= self.ttl:
+            return None
+        print(f'using cached Jama metadata for {url}')
+        return entry['metadata']
+
+    '''Stores the metadata for a Jama instance
+
+    Parameters:
+        url (string): The base URL of the Jama instance
+        metadata (dict): The metadata to store
+    '''
+    def set(self, url, metadata):
+        entries = self.__read()
+        entries[url] = dict(time=time.time(), metadata=metadata)
+        self.__write(entries)
+
+    '''Removes the cached metadata for a Jama instance, or for all instances if url is None'''
+    def invalidate(self, url=None):
+        if url is None:
+            if isfile(self.path):
+                os.remove(self.path)
+            return
+        entries = self.__read()
+        if entries.pop(url, None) is not None:
+            self.__write(entries)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Manage the cached Jama metadata')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    invalidate_parser = subparsers.add_parser('invalidate', help='remove the cached metadata')
+    invalidate_parser.add_argument('--url', dest='url', help='only remove the metadata of this Jama URL')
+    invalidate_parser.add_argument('--path', dest='path', default=DEFAULT_CACHE_PATH, help='cache file path')
+    args = parser.parse_args(argv)
+    if args.command == 'invalidate':
+        jama_metadata_cache(path=args.path).invalidate(url=args.url)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import threading
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import ConnectionError
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from urllib3.util.retry import Retry
+
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5  # retries wait 0.5s, 1s, 2s, ...
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# transport modes
+MODE_LIVE = 'live'  # talk to Jama
+MODE_RECORD = 'record'  # talk to Jama and save every response to the archive
+MODE_REPLAY = 'replay'  # serve every response from the archive without any network access
+DEFAULT_ARCHIVE_PATH = './jama-archive'
+
+_session = None
+_session_lock = threading.Lock()
+
+
+'''Archive of Jama responses stored as one JSON file per request in a directory
+
+Used both for the record/replay archive and for the conditional request cache. Requests are keyed by method and URL with the query parameters sorted, so the same
+query always maps to the same file.
+'''
+class response_archive:
+    def __init__(self, path=DEFAULT_ARCHIVE_PATH):
+        self.path = path
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+    '''Gets the file name of a request'''
+    def __get_file_path(self, request):
+        parts = urlsplit(request.url)
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        key = request.method + ' ' + urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'), key
+
+    '''Saves the response to a request'''
+    def record(self, request, response):
+        file_path, key = self.__get_file_path(request)
+        os.makedirs(self.path, exist_ok=True)
+        entry = dict(key=key,
+                     status_code=response.status_code,
+                     reason=response.reason,
+                     headers=dict(response.headers),
+                     encoding=response.encoding,
+                     body=response.content.decode('utf-8', errors='replace'))
+        tmp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, file_path)
+
+    '''Gets the saved response to a request, or None if it was not recorded'''
+    def replay(self, request):
+        file_path, key = self.__get_file_path(request)
+        if not os.path.isfile(file_path):
+            return None
+        with open(file_path) as f:
+            entry = json.load(f)
+        response = requests.Response()
+        response.status_code = entry['status_code']
+        response.reason = entry['reason']
+        # the body is stored decoded, so drop any transfer encoding of the original response
+        response.headers = CaseInsensitiveDict({k: v for k, v in entry['headers'].items()
+                                                if k.lower() not in ['content-encoding', 'transfer-encoding']})
+        response.encoding = entry['encoding']
+        response._content = entry['body'].encode('utf-8')
+        response.url = request.url
+        response.request = request
+        return response
+
+
+'''Transport adapter for live Jama traffic
+
+Optionally saves every response it receives to an archive, and optionally keeps GET
+responses that carry an ETag or Last-Modified validator in a disk cache. Cached
+responses are revalidated with a conditional request and served from the cache when
+Jama answers 304 Not Modified.
+'''
+class live_adapter(HTTPAdapter):
+    def __init__(self, archive=None, cache=None, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+        self.cache = cache
+
+    def send(self, request, **kwargs):
+        cached = None
+        if self.cache is not None and request.method == 'GET':
+            cached = self.cache.replay(request)
+            if cached is not None:
+                if 'ETag' in cached.headers:
+                    request.headers['If-None-Match'] = cached.headers['ETag']
+                if 'Last-Modified' in cached.headers:
+                    request.headers['If-Modified-Since'] = cached.headers['Last-Modified']
+        response = super().send(request, **kwargs)
+        if cached is not None and response.status_code == 304:
+            response.close()
+            response = cached
+        elif self.cache is not None and request.method == 'GET' and response.status_code == 200 \
+                and ('ETag' in response.headers or 'Last-Modified' in response.headers):
+            self.cache.record(request, response)
+        if self.archive is not None:
+            self.archive.record(request, response)
+        return response
+
+
+'''Transport adapter that serves every response from an archive'''
+class replay_adapter(BaseAdapter):
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        response = self.archive.replay(request)
+        if response is None:
+            raise ConnectionError(f'{request.method} {request.url} is not in the archive {self.archive.path}',
+                                  request=request)
+        return response
+
+    def close(self):
+        pass
+
+
+'''Creates a requests session with pooled keep-alive connections and retries
+
+Parameters:
+    pool_size (int): The maximum number of connections kept open per host
+    retries (int): The number of times to retry a failed request
+    backoff_factor (float): The base delay in seconds of the exponential backoff between retries
+    mode (string): MODE_LIVE, MODE_RECORD or MODE_REPLAY
+    archive_path (string): The directory of the response archive for MODE_RECORD and MODE_REPLAY
+    cache_path (string): The directory of the conditional request cache, or None to disable it
+
+Returns:
+    session (Session): The new session
+'''
+def create_session(pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                   mode=MODE_LIVE, archive_path=DEFAULT_ARCHIVE_PATH, cache_path=None):
+    retry = Retry(total=retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=RETRY_STATUS_CODES,
+                  # hand the last response back to the caller instead of raising, callers check the status
+                  raise_on_status=False)
+    adapter_args = dict(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    if mode == MODE_REPLAY:
+        adapter = replay_adapter(response_archive(archive_path))
+    else:
+        adapter = live_adapter(archive=response_archive(archive_path) if mode == MODE_RECORD else None,
+                               cache=response_archive(cache_path) if cache_path is not None else None,
+                               **adapter_args)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+'''Replaces the shared session used for all Jama traffic
+
+Parameters:
+    pool_size (int): The maximum number of connections kept open per host
+    retries (int): The number of times to retry a failed request
+    backoff_factor (float): The base delay in seconds of the exponential backoff between retries
+    mode (string): MODE_LIVE, MODE_RECORD or MODE_REPLAY
+    archive_path (string): The directory of the response archive for MODE_RECORD and MODE_REPLAY
+    cache_path (string): The directory of the conditional request cache, or None to disable it
+'''
+def configure(pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR,
+              mode=MODE_LIVE, archive_path=DEFAULT_ARCHIVE_PATH, cache_path=None):
+    global _session
+    with _session_lock:
+        _session = create_session(pool_size=pool_size, retries=retries, backoff_factor=backoff_factor,
+                                  mode=mode, archive_path=archive_path, cache_path=cache_path)
+
+
+'''Gets the shared session used for all Jama traffic, creating it with the defaults if needed
+
+The JAMA_TRANSPORT_MODE, JAMA_ARCHIVE_PATH and JAMA_CACHE_PATH environment variables select
+the transport mode and response cache of a session that was not configured explicitly.
+'''
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session(mode=os.environ.get('JAMA_TRANSPORT_MODE', MODE_LIVE),
+                                      archive_path=os.environ.get('JAMA_ARCHIVE_PATH', DEFAULT_ARCHIVE_PATH),
+                                      cache_path=os.environ.get('JAMA_CACHE_PATH'))
+        return _session
+
+
+'''Makes a py_jama_rest_client JamaClient send its requests through the shared session
+
+JamaClient keeps its own requests session inside its private Core object. It is swapped
+for the shared session so that Jama connections are pooled across all callers.
+
+Parameters:
+    client (JamaClient): The client to attach
+'''
+def attach(client):
+    core = getattr(client, '_JamaClient__core', None)
+    if core is None or not hasattr(core, '_Core__session'):
+        print('Cannot attach Jama client to the shared session, using its own connections')
+        return
+    core._Core__session = get_session()
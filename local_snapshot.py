@@ -0,0 +1,113 @@
+import os
+import datetime
+import threading
+import tzlocal
+import redis_params
+import testrun_utils
+from testrun_utils import COL_TESTPLAN
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:
+    pa = None
+    feather = None
+
+
+DEFAULT_SNAPSHOT_PATH = './contour-data.feather'
+
+
+'''Get the path of the local snapshot, set with the DATASET_SNAPSHOT_PATH environment variable'''
+def get_snapshot_path():
+    return os.getenv('DATASET_SNAPSHOT_PATH', DEFAULT_SNAPSHOT_PATH)
+
+
+'''Write the test runs to the local snapshot
+
+The snapshot is an uncompressed Feather file so that readers can memory-map it. It is
+written to a temporary file first, so readers never see a partial snapshot.
+
+Parameters:
+    df (dataframe): The test run data
+    path (string): The path of the snapshot, None for get_snapshot_path()
+'''
+def write_snapshot(df, path=None):
+    if feather is None:
+        raise ImportError('The local snapshot requires the pyarrow package')
+    path = path if path is not None else get_snapshot_path()
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    feather.write_feather(testrun_utils.df_to_table(df), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+'''Reader of the local snapshot written by the updater when Redis is not used
+
+The snapshot is memory-mapped read-only, so the pages of the file are shared by all the
+dashboard workers on the host. Only the rows of the test plans a worker shows are copied
+out of the mapping into dataframes, once per version. A new version is detected from the
+file status, which changes every time the updater replaces the file.
+'''
+class snapshot_reader:
+    def __init__(self, path=None):
+        if feather is None:
+            raise ImportError('The local snapshot requires the pyarrow package')
+        self.path = path if path is not None else get_snapshot_path()
+        self.version = None
+        self.table = None
+        self.testplans = None
+        self.plan_dfs = {}
+        self.modified_datetime = ''
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+    '''Maps the snapshot if it changed since it was last mapped
+
+    Returns:
+        table (Table): The memory-mapped test runs, None if there is no snapshot yet
+        testplans (series): The test plan of each row
+    '''
+    def __load(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None, None
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if version != self.version:
+                print(f'loading local snapshot {self.path}')
+                self.table = feather.read_table(self.path, memory_map=True)
+                # the test plan column is dictionary encoded, so this only copies one code per row
+                self.testplans = self.table.column(COL_TESTPLAN).to_pandas()
+                self.plan_dfs = {}
+                self.modified_datetime = datetime.datetime.fromtimestamp(
+                    stat.st_mtime, tzlocal.get_localzone()).strftime(redis_params.REDIS_TIME_FORMAT)
+                self.version = version
+            return self.table, self.testplans
+
+    '''Get the test runs of a test plan, or of all test plans if testplan is None'''
+    def get_dataframe(self, testplan=None):
+        table, testplans = self.__load()
+        if table is None:
+            return None
+        if testplan is None:
+            return testrun_utils.table_to_df(table)
+        with self.lock:
+            plan_df = self.plan_dfs.get(testplan)
+        if plan_df is None:
+            # only the rows of the test plan are copied out of the mapped file
+            plan_df = testrun_utils.table_to_df(table.filter(pa.array(testplans.eq(testplan).values)))
+            with self.lock:
+                self.plan_dfs[testplan] = plan_df
+        return plan_df
+
+    '''Get the names of the test plans in the snapshot, in dataset order'''
+    def get_testplans(self):
+        _, testplans = self.__load()
+        return list(testplans.unique()) if testplans is not None else []
+
+    '''Get the date and time the snapshot was written, an empty string if there is no snapshot yet'''
+    def get_modified_datetime(self):
+        self.__load()
+        return self.modified_datetime
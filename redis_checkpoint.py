@@ -0,0 +1,55 @@
+import json
+import redis_params
+
+
+DEFAULT_TTL = 3600  # seconds
+
+
+'''Checkpoints of a refresh stored in Redis
+
+jama_client writes the test cycles of each test plan and the raw test runs of each test
+cycle here as soon as they are downloaded. If the refresh fails, or the worker is killed
+or restarted, the next attempt reuses the completed units and only downloads the rest.
+The checkpoints expire ttl seconds after the last write so a stale partial refresh is
+never resumed, and are cleared once a refresh completes.
+'''
+class redis_checkpoint:
+    def __init__(self, redis_inst, ttl=DEFAULT_TTL):
+        self.redis_inst = redis_inst
+        self.ttl = ttl
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+    '''Reads a checkpoint, returns None if it does not exist'''
+    def __get(self, key):
+        data = self.redis_inst.hget(redis_params.REDIS_CHECKPOINT_HASH_NAME, key)
+        return json.loads(data.decode('utf-8')) if data is not None else None
+
+    '''Writes a checkpoint and restarts the expiry of all checkpoints'''
+    def __set(self, key, value):
+        pipe = self.redis_inst.pipeline()
+        pipe.hset(redis_params.REDIS_CHECKPOINT_HASH_NAME, key, json.dumps(value))
+        pipe.expire(redis_params.REDIS_CHECKPOINT_HASH_NAME, self.ttl)
+        pipe.execute()
+
+    '''Gets the checkpointed (testcycle id, testcycle name) list of a testplan'''
+    def get_testcycles(self, project_id, testplan_key):
+        testcycles = self.__get(f'plan:{project_id}:{testplan_key}')
+        return [tuple(x) for x in testcycles] if testcycles is not None else None
+
+    '''Checkpoints the (testcycle id, testcycle name) list of a testplan'''
+    def set_testcycles(self, project_id, testplan_key, testcycles):
+        self.__set(f'plan:{project_id}:{testplan_key}', testcycles)
+
+    '''Gets the checkpointed raw testruns of a testcycle'''
+    def get_testruns(self, testcycle_id):
+        return self.__get(f'cycle:{testcycle_id}')
+
+    '''Checkpoints the raw testruns of a testcycle'''
+    def set_testruns(self, testcycle_id, testruns_raw):
+        self.__set(f'cycle:{testcycle_id}', testruns_raw)
+
+    '''Removes all checkpoints once a refresh has completed'''
+    def clear(self):
+        self.redis_inst.delete(redis_params.REDIS_CHECKPOINT_HASH_NAME)
@@ -1,49 +1,356 @@
 import os
+import json
 import redis
+import pandas as pd
 import datetime
+import time
+import threading
 import tzlocal
 import redis_params
 import testrun_utils
 
 
-'''Get the Redis database instance'''
+# connections to REDIS_URL shared by all the Redis instances of the process
+_pool = None
+_pool_lock = threading.Lock()
+
+
+'''Get the Redis database instance
+
+All instances share one connection pool. REDIS_MAX_CONNECTIONS caps the number of
+connections in the pool.
+'''
 def get_redis_inst():
+    global _pool
     redis_url = os.getenv('REDIS_URL')
     if redis_url is None:
         return None
-    redis_inst = redis.StrictRedis.from_url(redis_url)
+    with _pool_lock:
+        if _pool is None:
+            max_connections = os.getenv('REDIS_MAX_CONNECTIONS')
+            _pool = redis.ConnectionPool.from_url(
+                redis_url, max_connections=int(max_connections) if max_connections is not None else None)
+    redis_inst = redis.StrictRedis(connection_pool=_pool)
     return redis_inst
 
 
-'''Update data to redis if data has changed'''
-def set_dataframe(redis_inst, df):
-    json_str = testrun_utils.df_to_json(df)
+'''Get the name of the change-log stream of a test plan'''
+def __get_changes_stream_name(testplan):
+    return f'{redis_params.REDIS_CHANGES_STREAM_NAME}:{testplan}'
+
+
+'''Get the change-log entry of a test plan
+
+The entry holds the row-level differences to the previous version of the test plan, or the
+whole test plan as a snapshot when there is no previous version to compare to. prev is the
+version of the test plan the entry applies to, 0 if there is none.
+'''
+def __get_change_entry(prev_version, old_df, new_df, payload, fmt, codec):
+    entry = dict(prev=prev_version)
+    if old_df is None or testrun_utils.COL_TESTRUN_ID not in old_df.columns \
+            or testrun_utils.COL_TESTRUN_ID not in new_df.columns:
+        entry['snapshot'] = payload
+        return entry
+    delta = testrun_utils.get_df_delta(old_df, new_df)
+    for key in ['added', 'changed']:
+        if not delta[key].empty:
+            entry[key] = testrun_utils.df_to_payload(delta[key], fmt=fmt, codec=codec)
+    entry['removed'] = json.dumps(delta['removed'])
+    return entry
+
+
+'''Update data to redis if data has changed
+
+The dataset is stored as one payload per test plan in REDIS_PLAN_HASH_NAME, next to a
+manifest of the test plans with their versions and content hashes, so that readers can
+fetch only the test plans they show. Only the test plans whose hash changed are written.
+Payloads use the format given by the DATASET_FORMAT environment variable, Arrow if
+pyarrow is installed and JSON otherwise, compressed with the codec given by DATASET_CODEC,
+the best codec installed by default.
+
+Every test plan that changed also gets an entry with ID '<version>-0' in its own change-log
+stream, '<REDIS_CHANGES_STREAM_NAME>:<test plan>', holding its row-level changes, so that
+readers only download the changes of the test plans they hold, see update_dataframe().
+The stream of a test plan is deleted when the test plan leaves the dataset.
+
+The data, the modified and updated times and the incremental sync state are written in a
+single transaction, so readers never see a modified time without the data it belongs to.
+
+Parameters:
+    df (dataframe): The test run data
+    watermarks (dict): The modifiedDate watermark of each test plan to save, None to leave them
+    full_sync (bool): Whether or not df is the result of a full download
+
+Returns:
+    changed (bool): Whether or not the data in redis changed
+'''
+def set_dataframe(redis_inst, df, watermarks=None, full_sync=False):
+    fmt = os.getenv('DATASET_FORMAT')
+    codec = os.getenv('DATASET_CODEC')
+    manifest = get_manifest(redis_inst)
+    old_plans = manifest['plans'] if manifest is not None else {}
+    version = manifest['version'] + 1 if manifest is not None else 1
+
+    payloads = {}
+    plan_dfs = {}
+    plans = {}
+    for testplan, plan_df in df.groupby(testrun_utils.COL_TESTPLAN, sort=False, observed=True):
+        # each test plan only keeps the categories it uses
+        plan_df = testrun_utils.to_categorical(plan_df.reset_index(drop=True), remove_unused=True)
+        plan_hash = testrun_utils.get_df_hash(plan_df)
+        old_plan = old_plans.get(testplan)
+        if old_plan is not None and old_plan.get('hash') == plan_hash:
+            plans[testplan] = old_plan
+            continue
+        payloads[testplan] = testrun_utils.df_to_payload(plan_df, fmt=fmt, codec=codec)
+        plan_dfs[testplan] = plan_df
+        plans[testplan] = dict(version=version, rows=len(plan_df), hash=plan_hash)
+    removed = [x for x in old_plans if x not in plans]
+    if manifest is not None and len(payloads) == 0 and len(removed) == 0 and list(plans) == list(old_plans):
+        pipe = redis_inst.pipeline()
+        set_updated_datetime(pipe)
+        __set_sync_state(pipe, watermarks, full_sync)
+        pipe.execute()
+        return False
+
+    # the previous version of the changed test plans, to publish their row-level changes
+    updated = [x for x in payloads if x in old_plans]
+    old_payloads = redis_inst.hmget(redis_params.REDIS_PLAN_HASH_NAME, updated) if len(updated) > 0 else []
+    old_dfs = {k: testrun_utils.payload_to_df(v) for k, v in zip(updated, old_payloads) if v is not None}
+    entries = {x: __get_change_entry(old_plans[x]['version'] if x in old_plans else 0,
+                                     old_dfs.get(x), plan_dfs[x], payloads[x], fmt, codec)
+               for x in payloads}
+    # versions restart at 1, drop the change-logs of any previous dataset
+    stale_streams = list(redis_inst.scan_iter(match=__get_changes_stream_name('*'))) if manifest is None else []
 
     # Save testrun dataframes in redis so that the Dash app, running on a separate
     # process, can read it
-    resp = redis_inst.hset(
-        redis_params.REDIS_HASH_NAME,
-        redis_params.REDIS_DATASET_KEY,
-        json_str
-    )
-    return resp
+    pipe = redis_inst.pipeline()
+    if len(payloads) > 0:
+        pipe.hset(redis_params.REDIS_PLAN_HASH_NAME, mapping=payloads)
+    if len(removed) > 0:
+        pipe.hdel(redis_params.REDIS_PLAN_HASH_NAME, *removed)
+    pipe.hset(redis_params.REDIS_HASH_NAME, redis_params.REDIS_MANIFEST_KEY,
+              json.dumps(dict(version=version, plans=plans)))
+    # drop the unsharded dataset and the single change-log stream written by earlier versions
+    pipe.hdel(redis_params.REDIS_HASH_NAME, redis_params.REDIS_DATASET_KEY)
+    pipe.delete(redis_params.REDIS_CHANGES_STREAM_NAME)
+    stale_streams += [__get_changes_stream_name(x) for x in removed]
+    if len(stale_streams) > 0:
+        pipe.delete(*stale_streams)
+    for testplan, entry in entries.items():
+        pipe.xadd(__get_changes_stream_name(testplan), entry, id=f'{version}-0',
+                  maxlen=redis_params.REDIS_CHANGES_MAXLEN, approximate=True)
+    set_modified_datetime(pipe)
+    set_updated_datetime(pipe)
+    # the watermarks are only saved together with the data they describe
+    __set_sync_state(pipe, watermarks, full_sync)
+    pipe.execute()
+    return True
 
 
-'''Get dataframe from redis in json format'''
-def get_dataframe_json(redis_inst):
-    data = redis_inst.hget(
-        redis_params.REDIS_HASH_NAME, redis_params.REDIS_DATASET_KEY
-    )
-    if data is None:
+'''Queue the incremental sync state on a pipeline'''
+def __set_sync_state(pipe, watermarks, full_sync):
+    if watermarks is not None:
+        __set_sync_watermarks(pipe, watermarks)
+    if full_sync:
+        set_full_sync_time(pipe)
+
+
+'''Get the manifest of the dataset in redis
+
+Returns:
+    manifest (dict): The dataset version and a dict of test plan name to its version, number
+        of rows and content hash, in dataset order. None if the dataset is not sharded by test plan.
+'''
+def get_manifest(redis_inst):
+    data = redis_inst.hget(redis_params.REDIS_HASH_NAME, redis_params.REDIS_MANIFEST_KEY)
+    return json.loads(data.decode('utf-8')) if data is not None else None
+
+
+'''Get the names of the test plans in redis, in dataset order'''
+def get_testplans(redis_inst):
+    manifest = get_manifest(redis_inst)
+    if manifest is not None:
+        return list(manifest['plans'])
+    df = get_dataframe(redis_inst)
+    return list(testrun_utils.get_testplan_labels(df)) if df is not None else []
+
+
+'''Read the manifest and the payloads of test plans in one round trip
+
+The reads are done in a transaction, so the payloads always belong to the manifest.
+
+Returns:
+    manifest (dict): See get_manifest()
+    payloads (list): The payload of each test plan found, in dataset order when testplans
+        is None. A dataset written by earlier versions is returned as a single payload
+        holding all test plans.
+'''
+def __read_dataset(redis_inst, testplans):
+    pipe = redis_inst.pipeline()
+    pipe.hget(redis_params.REDIS_HASH_NAME, redis_params.REDIS_MANIFEST_KEY)
+    pipe.hget(redis_params.REDIS_HASH_NAME, redis_params.REDIS_DATASET_KEY)
+    if testplans is None:
+        pipe.hgetall(redis_params.REDIS_PLAN_HASH_NAME)
+    elif len(testplans) > 0:
+        pipe.hmget(redis_params.REDIS_PLAN_HASH_NAME, testplans)
+    results = pipe.execute()
+    manifest = json.loads(results[0].decode('utf-8')) if results[0] is not None else None
+    if manifest is None:
+        return None, [results[1]] if results[1] is not None else []
+    if testplans is None:
+        data = results[2]
+        return manifest, [data[x.encode('utf-8')] for x in manifest['plans'] if x.encode('utf-8') in data]
+    return manifest, [x for x in results[2] if x is not None] if len(testplans) > 0 else []
+
+
+'''Get the change-log entries of a test plan between two versions of the dataset
+
+Parameters:
+    entries (list): The entries of the test plan's stream after version since
+    plan_version (int): The version the test plan last changed at
+    since (int): The version the changes start from, excluded
+    until (int): The current version of the dataset
+
+Returns:
+    changes (list): The entries in version order, each a dict of field name to value. None
+        if the stream no longer holds all the changes, or if until is older than since.
+'''
+def __get_plan_changes(entries, plan_version, since, until):
+    if until < since:
+        # the dataset was written again from version 1
+        return None
+    if plan_version <= since:
+        return []
+    entries = [{k.decode('utf-8'): v for k, v in fields.items()} for entry_id, fields in entries
+               if int(entry_id.decode('utf-8').split('-')[0]) <= until]
+    # the first entry must apply to the version read earlier, older entries were trimmed otherwise
+    if len(entries) == 0 or int(entries[0]['prev'].decode('utf-8')) > since:
         return None
-    jsonified_df = data.decode('utf-8')
-    return jsonified_df
+    return entries
 
 
-'''Get dataframe from redis in pandas dataframe format'''
-def get_dataframe(redis_inst):
-    jsonified_df = get_dataframe_json(redis_inst)
-    return testrun_utils.json_to_df(jsonified_df) if jsonified_df is not None else None
+'''Bring a test plan read earlier up to date
+
+The current version and the changes since the given version are read from the manifest and
+the change-log stream of the test plan in one round trip and applied to the test plan. The
+whole test plan is read instead when it was not read before, or when the stream no longer
+holds all the changes.
+
+Parameters:
+    testplan (string): The name of the test plan
+    df (dataframe): The test plan as read earlier, None if it was not read before
+    version (int): The dataset version df was read at
+
+Returns:
+    version (int): The current dataset version, None for a dataset written by earlier versions
+    df (dataframe): The current test plan, None if it is not in redis
+'''
+def update_dataframe(redis_inst, testplan, df=None, version=None):
+    if df is not None and version is not None:
+        pipe = redis_inst.pipeline()
+        pipe.hget(redis_params.REDIS_HASH_NAME, redis_params.REDIS_MANIFEST_KEY)
+        pipe.xrange(__get_changes_stream_name(testplan), min=str(version + 1), max='+')
+        manifest_data, entries = pipe.execute()
+        manifest = json.loads(manifest_data.decode('utf-8')) if manifest_data is not None else None
+        if manifest is not None and testplan not in manifest['plans'] and manifest['version'] >= version:
+            # the test plan left the dataset
+            return manifest['version'], None
+        changes = None
+        if manifest is not None and testplan in manifest['plans']:
+            changes = __get_plan_changes(entries, manifest['plans'][testplan]['version'], version,
+                                         manifest['version'])
+        if changes is not None:
+            for fields in changes:
+                if 'snapshot' in fields:
+                    df = testrun_utils.payload_to_df(fields['snapshot'])
+                else:
+                    df = testrun_utils.apply_df_delta(
+                        df, dict(added=testrun_utils.payload_to_df(fields.get('added')),
+                                 changed=testrun_utils.payload_to_df(fields.get('changed')),
+                                 removed=json.loads(fields['removed'])))
+            return manifest['version'], df
+    return get_versioned_dataframe(redis_inst, [testplan])
+
+
+'''Get dataframe from redis in json format'''
+def get_dataframe_json(redis_inst, testplans=None):
+    df = get_dataframe(redis_inst, testplans)
+    return testrun_utils.df_to_json(df) if df is not None else None
+
+
+'''Get dataframe from redis in pandas dataframe format, together with the dataset version
+
+Parameters:
+    testplans (list): The names of the test plans to get, None for all test plans
+
+Returns:
+    version (int): The dataset version, None for a dataset written by earlier versions
+    df (dataframe): The test runs, None if there are none in redis
+'''
+def get_versioned_dataframe(redis_inst, testplans=None):
+    manifest, payloads = __read_dataset(redis_inst, testplans)
+    version = manifest['version'] if manifest is not None else None
+    if len(payloads) == 0:
+        return version, None
+    dfs = [testrun_utils.payload_to_df(x) for x in payloads]
+    df = testrun_utils.to_categorical(pd.concat(dfs, ignore_index=True)) if len(dfs) > 1 else dfs[0]
+    if testplans is not None and manifest is None:
+        # a dataset written by earlier versions holds all test plans
+        df = df[df[testrun_utils.COL_TESTPLAN].isin(testplans)].reset_index(drop=True)
+    return version, df
+
+
+'''Get dataframe from redis in pandas dataframe format
+
+Parameters:
+    testplans (list): The names of the test plans to get, None for all test plans
+'''
+def get_dataframe(redis_inst, testplans=None):
+    return get_versioned_dataframe(redis_inst, testplans)[1]
+
+
+'''Record today's status counts in the daily status snapshots of each test plan
+
+The snapshots of a test plan are stored as one payload in REDIS_SNAPSHOT_HASH_NAME holding
+a row per day and test cycle, test group, priority and planned week, see
+testrun_utils.get_status_snapshot(). Today's rows are replaced on every call.
+
+Parameters:
+    df (dataframe): The test run data
+    force (bool): Whether or not to record the snapshot if one was already recorded today
+'''
+def update_status_snapshots(redis_inst, df, force=False):
+    day = datetime.date.today()
+    last_day = redis_inst.hget(redis_params.REDIS_HASH_NAME, redis_params.REDIS_SNAPSHOT_DATE_KEY)
+    if not force and last_day is not None and last_day.decode('utf-8') == day.isoformat():
+        return
+    fmt = os.getenv('DATASET_FORMAT')
+    codec = os.getenv('DATASET_CODEC')
+    snapshot = testrun_utils.get_status_snapshot(df, day)
+    testplans = list(snapshot[testrun_utils.COL_TESTPLAN].unique())
+    if len(testplans) == 0:
+        return
+    old_payloads = redis_inst.hmget(redis_params.REDIS_SNAPSHOT_HASH_NAME, testplans)
+    payloads = {}
+    for testplan, old_payload in zip(testplans, old_payloads):
+        series = snapshot[snapshot[testrun_utils.COL_TESTPLAN] == testplan]
+        if old_payload is not None:
+            old_series = testrun_utils.payload_to_df(old_payload)
+            old_series = old_series[old_series[testrun_utils.COL_SNAPSHOT_DATE] != pd.Timestamp(day)]
+            series = pd.concat([old_series, series], ignore_index=True)
+        payloads[testplan] = testrun_utils.df_to_payload(series.reset_index(drop=True), fmt=fmt, codec=codec)
+
+    pipe = redis_inst.pipeline()
+    pipe.hset(redis_params.REDIS_SNAPSHOT_HASH_NAME, mapping=payloads)
+    pipe.hset(redis_params.REDIS_HASH_NAME, redis_params.REDIS_SNAPSHOT_DATE_KEY, day.isoformat())
+    pipe.execute()
+
+
+'''Get the daily status snapshots of a test plan, None if there are none'''
+def get_status_snapshots(redis_inst, testplan):
+    return testrun_utils.payload_to_df(redis_inst.hget(redis_params.REDIS_SNAPSHOT_HASH_NAME, testplan))
 
 
 '''set the date and time the data was last checked against existing data in redis
@@ -65,8 +372,8 @@ def get_updated_datetime(redis_inst):
     data_last_updated = redis_inst.hget(
         redis_params.REDIS_HASH_NAME,
         redis_params.REDIS_UPDATED_KEY
-    ).decode('utf-8')
-    return data_last_updated
+    )
+    return data_last_updated.decode('utf-8') if data_last_updated is not None else None
 
 
 '''set the date and time the data was last modified'''
@@ -84,8 +391,38 @@ def get_modified_datetime(redis_inst):
     data_last_modified = redis_inst.hget(
         redis_params.REDIS_HASH_NAME,
         redis_params.REDIS_MODIFIED_KEY
-    ).decode('utf-8')
+    )
     if data_last_modified is None:
-        data_last_modified = ''
-    return data_last_modified
+        return ''
+    return data_last_modified.decode('utf-8')
+
+
+'''Queue the modifiedDate watermarks on a pipeline, replacing any previous watermarks'''
+def __set_sync_watermarks(pipe, watermarks):
+    pipe.delete(redis_params.REDIS_WATERMARK_HASH_NAME)
+    if len(watermarks) > 0:
+        pipe.hset(redis_params.REDIS_WATERMARK_HASH_NAME, mapping=watermarks)
+
+
+'''retrieve the modifiedDate watermark of each test plan'''
+def get_sync_watermarks(redis_inst):
+    data = redis_inst.hgetall(redis_params.REDIS_WATERMARK_HASH_NAME)
+    return {k.decode('utf-8'): v.decode('utf-8') for k, v in data.items()}
 
+
+'''set the time of the last full download of the test runs'''
+def set_full_sync_time(redis_inst):
+    redis_inst.hset(
+        redis_params.REDIS_HASH_NAME,
+        redis_params.REDIS_FULL_SYNC_KEY,
+        str(time.time())
+    )
+
+
+'''retrieve the time of the last full download of the test runs in seconds since the epoch'''
+def get_full_sync_time(redis_inst):
+    data = redis_inst.hget(
+        redis_params.REDIS_HASH_NAME,
+        redis_params.REDIS_FULL_SYNC_KEY
+    )
+    return float(data.decode('utf-8')) if data is not None else None
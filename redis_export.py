@@ -1,16 +1,234 @@
 import redis_data
+import local_snapshot
+import testrun_utils
 import argparse
+import hashlib
+import os
+import re
 import sys
 import pandas as pd
 from pandas import ExcelWriter
+from concurrent.futures import ThreadPoolExecutor
+from testrun_utils import COL_TESTCYCLE, COL_TESTGROUP, COL_PLANNED_WEEK, COL_STATUS
+from jama_client import CATEGORICAL_COLUMNS, TESTRUN_COLUMNS, COL_PROJECT
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+FORMAT_CSV = 'csv'
+FORMAT_PARQUET = 'parquet'
+FORMAT_XLSX = 'xlsx'
+EXPORT_FORMATS = [FORMAT_CSV, FORMAT_PARQUET, FORMAT_XLSX]
+DEFAULT_CHUNK_SIZE = 50000  # rows written at a time
+XLSX_SHEET_NAME = 'testruns'
+
+
+'''Source of the test runs, Redis if REDIS_URL is set and the local snapshot otherwise
+
+Test runs are read one test plan at a time, so only the test plans being written are in memory.
+'''
+class testrun_source:
+    def __init__(self):
+        self.redis_inst = redis_data.get_redis_inst()
+        self.snapshot = local_snapshot.snapshot_reader() if self.redis_inst is None else None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+    '''Get the names of the test plans, in dataset order'''
+    def get_testplans(self):
+        if self.redis_inst is not None:
+            return redis_data.get_testplans(self.redis_inst)
+        return self.snapshot.get_testplans()
+
+    '''Get the test runs of a test plan'''
+    def get_dataframe(self, testplan):
+        if self.redis_inst is not None:
+            return redis_data.get_dataframe(self.redis_inst, [testplan])
+        return self.snapshot.get_dataframe(testplan)
+
+
+'''Filters the test runs, keeping the rows that match any of the values given for each column
+
+Parameters:
+    df (dataframe): The test runs
+    testcycles (list): The test cycles to keep, None for all
+    testgroups (list): The test groups to keep, None for all
+    weeks (list): The planned weeks to keep, None for all
+    statuses (list): The statuses to keep, None for all
+
+Returns:
+    df (dataframe): The matching test runs
+'''
+def filter_testruns(df, testcycles=None, testgroups=None, weeks=None, statuses=None):
+    for col, values in [(COL_TESTCYCLE, testcycles), (COL_TESTGROUP, testgroups),
+                        (COL_PLANNED_WEEK, weeks), (COL_STATUS, statuses)]:
+        if values:
+            df = df[df[col].isin(values)]
+    return df
+
+
+'''Writes test plans to one file, one test plan and chunk of rows at a time
+
+CSV and Parquet files are written as the chunks come. An XLSX workbook is kept in memory
+until it is closed, so large exports should use CSV or Parquet. When no test runs match,
+a file with only the columns is written.
+
+Parameters:
+    source (testrun_source): Where to read the test runs from
+    testplans (list): The names of the test plans to write
+    path (string): The output file
+    fmt (string): One of EXPORT_FORMATS
+    filters (dict): Keyword arguments for filter_testruns()
+    chunk_size (int): The number of rows written at a time
+
+Returns:
+    rows (int): The number of test runs written
+'''
+def export_testplans(source, testplans, path, fmt, filters, chunk_size=DEFAULT_CHUNK_SIZE):
+    rows = 0
+    parquet_writer = None
+    # the columns of an empty export
+    empty_df = pd.DataFrame(columns=[x for x in TESTRUN_COLUMNS if x != COL_PROJECT])
+    excel_writer = ExcelWriter(path) if fmt == FORMAT_XLSX else None
+    try:
+        for testplan in testplans:
+            df = source.get_dataframe(testplan)
+            if df is None:
+                print(f'Test plan {testplan} not found')
+                continue
+            df = filter_testruns(df, **filters)
+            if rows == 0:
+                empty_df = df.iloc[:0]
+            for start in range(0, len(df), chunk_size):
+                chunk = df.iloc[start:start + chunk_size]
+                if fmt == FORMAT_CSV:
+                    chunk.to_csv(path, mode='w' if rows == 0 else 'a', header=rows == 0, index=False)
+                elif fmt == FORMAT_PARQUET:
+                    table = __to_parquet_table(chunk, parquet_writer.schema if parquet_writer is not None else None)
+                    if parquet_writer is None:
+                        parquet_writer = pq.ParquetWriter(path, table.schema)
+                    parquet_writer.write_table(table)
+                else:
+                    chunk.to_excel(excel_writer, sheet_name=XLSX_SHEET_NAME, startrow=rows + 1 if rows > 0 else 0,
+                                   header=rows == 0, index=False)
+                rows += len(chunk)
+            print(f'{testplan}: {len(df)} test runs')
+        if rows == 0:
+            # still write the columns of an empty export
+            if fmt == FORMAT_CSV:
+                empty_df.to_csv(path, index=False)
+            elif fmt == FORMAT_PARQUET:
+                table = __to_parquet_table(empty_df)
+                parquet_writer = pq.ParquetWriter(path, table.schema)
+                parquet_writer.write_table(table)
+            else:
+                empty_df.to_excel(excel_writer, sheet_name=XLSX_SHEET_NAME, index=False)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+        if excel_writer is not None:
+            excel_writer.close()
+    print(f'wrote {rows} test runs to {path}')
+    return rows
+
+
+'''Converts a chunk of test runs to an Arrow table with the schema of the previous chunks
+
+Categorical columns are written as plain strings, since the dictionaries of different
+test plans do not match. Columns without any values are written as strings.
+'''
+def __to_parquet_table(df, schema=None):
+    df = df.copy()
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(object)
+    table = testrun_utils.df_to_table(df)
+    if schema is None:
+        fields = [pa.field(x.name, pa.string()) if pa.types.is_null(x.type) else x for x in table.schema]
+        return table.cast(pa.schema(fields, metadata=table.schema.metadata))
+    return table.cast(schema)
+
+
+'''Get a file name for each test plan
+
+Characters that are not allowed in file names are replaced, so different test plans can
+map to the same name, e.g. 'Plan/B' and 'Plan_B'. Those test plans get a short hash of
+their name appended, so no two test plans are written to the same file. Names are compared
+without case for case-insensitive file systems.
+
+Returns:
+    file_names (dict): The file name of each test plan
+'''
+def __get_file_names(testplans, fmt):
+    names = {x: re.sub(r'[^\w\-. ]', '_', x).strip() for x in testplans}
+    counts = {}
+    for name in names.values():
+        counts[name.lower()] = counts.get(name.lower(), 0) + 1
+    for testplan, name in names.items():
+        if counts[name.lower()] > 1:
+            names[testplan] = f'{name}-{hashlib.sha1(testplan.encode("utf-8")).hexdigest()[:8]}'
+    return {k: f'{v}.{fmt}' for k, v in names.items()}
+
 
 def main(argv):
-    parser = argparse.ArgumentParser(description='')
-    parser.add_argument('-o', dest='output', help='CSV output file name', required=True)
-    args = parser.parse_args()
-    redis_inst = redis_data.get_redis_inst()
-    df = redis_data.get_dataframe(redis_inst)
-    df.to_csv(args.output)
+    parser = argparse.ArgumentParser(description='Export the test runs to CSV, Parquet or XLSX files')
+    parser.add_argument('-o', dest='output', required=True,
+                        help='output file name, or output directory with --per-plan')
+    parser.add_argument('-f', '--format', dest='format', choices=EXPORT_FORMATS,
+                        help='output format, guessed from the output file name by default')
+    parser.add_argument('--plan', dest='plans', action='append', help='test plan to export, can be repeated')
+    parser.add_argument('--cycle', dest='testcycles', action='append', help='test cycle to export, can be repeated')
+    parser.add_argument('--group', dest='testgroups', action='append', help='test group to export, can be repeated')
+    parser.add_argument('--week', dest='weeks', action='append', help='planned week to export, can be repeated')
+    parser.add_argument('--status', dest='statuses', action='append', help='status to export, can be repeated')
+    parser.add_argument('--per-plan', dest='per_plan', action='store_true',
+                        help='write one file per test plan into the output directory')
+    parser.add_argument('--workers', dest='workers', type=int, default=1,
+                        help='number of test plan files written at the same time with --per-plan')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='number of rows written at a time')
+    args = parser.parse_args(argv)
+
+    fmt = args.format
+    if fmt is None:
+        ext = os.path.splitext(args.output)[1].lower().lstrip('.')
+        fmt = ext if ext in EXPORT_FORMATS else FORMAT_CSV
+    if fmt == FORMAT_PARQUET and pq is None:
+        parser.error('Parquet export requires the pyarrow package')
+
+    source = testrun_source()
+    testplans = source.get_testplans()
+    if args.plans:
+        missing = [x for x in args.plans if x not in testplans]
+        if len(missing) > 0:
+            print(f'Test plans not found: {", ".join(missing)}')
+        testplans = [x for x in testplans if x in args.plans]
+    filters = dict(testcycles=args.testcycles, testgroups=args.testgroups, weeks=args.weeks, statuses=args.statuses)
+
+    if not args.per_plan:
+        export_testplans(source, testplans, args.output, fmt, filters, chunk_size=args.chunk_size)
+        return
+
+    os.makedirs(args.output, exist_ok=True)
+    file_names = __get_file_names(testplans, fmt)
+
+    def export_testplan(testplan):
+        path = os.path.join(args.output, file_names[testplan])
+        return export_testplans(source, [testplan], path, fmt, filters, chunk_size=args.chunk_size)
+
+    if args.workers > 1 and len(testplans) > 1:
+        with ThreadPoolExecutor(max_workers=min(args.workers, len(testplans))) as executor:
+            rows = sum(executor.map(export_testplan, testplans))
+    else:
+        rows = sum(export_testplan(x) for x in testplans)
+    print(f'exported {rows} test runs from {len(testplans)} test plans')
+
 
 if __name__ == '__main__':
     main(sys.argv[1:])
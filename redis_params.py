@@ -1,6 +1,15 @@
 
 REDIS_HASH_NAME = 'IDIRECT_CONTOUR_TESTRUN_HASH'
 REDIS_DATASET_KEY = 'TESTRUN_DATASET'
+REDIS_MANIFEST_KEY = 'TESTRUN_MANIFEST'
+REDIS_PLAN_HASH_NAME = 'IDIRECT_CONTOUR_TESTRUN_PLAN_HASH'
+REDIS_CHANGES_STREAM_NAME = 'IDIRECT_CONTOUR_TESTRUN_CHANGES'
+REDIS_CHANGES_MAXLEN = 100  # approximate number of change-log entries kept per test plan
+REDIS_SNAPSHOT_HASH_NAME = 'IDIRECT_CONTOUR_STATUS_SNAPSHOT_HASH'
+REDIS_SNAPSHOT_DATE_KEY = 'STATUS_SNAPSHOT_DATE'
 REDIS_UPDATED_KEY = 'TESTRUN_UPDATED_TIME'
 REDIS_MODIFIED_KEY = 'TESTRUN_MODIFIED_TIME'
+REDIS_FULL_SYNC_KEY = 'TESTRUN_FULL_SYNC_TIME'
+REDIS_WATERMARK_HASH_NAME = 'IDIRECT_CONTOUR_TESTRUN_WATERMARK_HASH'
 REDIS_TIME_FORMAT= '%a, %b %d %Y %H:%M:%S %z'
+REDIS_CHECKPOINT_HASH_NAME = 'IDIRECT_CONTOUR_CHECKPOINT_HASH'
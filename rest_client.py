@@ -1,5 +1,58 @@
-import requests
 import json
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import jama_session
+
+
+MAX_PAGE_SIZE = 50  # the API can only get 50 results at a time
+DEFAULT_PAGE_WORKERS = 4  # number of pages to request at the same time
+
+
+'''Gets all results of a paged Jama resource
+
+The first page is requested on its own to read the total number of results, the
+remaining pages are then requested at the same time.
+
+Parameters:
+  url (string): The base url of the Jama instance
+  resource (string): The resource path under /rest/latest/
+  params (dict): The query parameters
+  page_size (int): The number of results per page, at most MAX_PAGE_SIZE
+  max_workers (int): The number of pages to request at the same time
+  request_slots (Semaphore): Optional limit on the requests in flight, held for each page
+
+Returns:
+  data (list): The results of all pages in order
+'''
+def get_all_pages(url, resource, username, password, ssl_verify=True, params=None, page_size=MAX_PAGE_SIZE,
+                  max_workers=DEFAULT_PAGE_WORKERS, request_slots=None):
+  page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+  full_url = url + '/rest/latest/' + resource
+
+  def get_page(start):
+    page_params = dict(params or {}, maxResults=page_size, startAt=start)
+    with request_slots if request_slots is not None else contextlib.nullcontext():
+      myResponse = jama_session.get_session().get(full_url, params=page_params, auth=(username, password),
+                                                  verify=ssl_verify)
+    # If response code is not ok (200), raise the resulting http error code with description
+    myResponse.raise_for_status()
+    return json.loads(myResponse.content)
+
+  first = get_page(0)
+  total = first['meta']['pageInfo'].get('totalResults', 0)
+  starts = list(range(page_size, total, page_size))
+  if max_workers > 1 and len(starts) > 1:
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(starts))) as executor:
+      # map() keeps the pages in order
+      pages = list(executor.map(get_page, starts))
+  else:
+    pages = [get_page(x) for x in starts]
+
+  data = first['data']
+  for page in pages:
+    data += page['data']
+  return data
+
 
 '''Gets a list of active testplans in a project
 
@@ -10,45 +63,59 @@ Parameters:
 Returns:
   active_plans (list): A list of all active testplans
 '''
-def get_active_testplans(url, project, username, password, ssl_verify=True):
-  result_count = 50
-  start = 0
+def get_active_testplans(url, project, username, password, ssl_verify=True, page_size=MAX_PAGE_SIZE,
+                         max_workers=DEFAULT_PAGE_WORKERS):
   active_plans = []
 
-  # the API can only get 50 runs at a time, so while result count == 50, there are stil more
-  while result_count == 50:
-    full_url = url + '/rest/latest/testplans?project={}&maxResults=50&startAt={}'.format(str(project), str(start))
-    myResponse = requests.get(full_url, auth=(username, password), verify=ssl_verify)
-
-    # for successful API call, response code will be 200 (OK)
-    if myResponse.ok:
-      # load the response data into a dict variable
-      resp_json = json.loads(myResponse.content)
-
-      # update result_count and start
-      result_count = resp_json['meta']['pageInfo']['resultCount']
-      start = start + 50
-      print('found {} testplans:'.format(result_count))
-
-      for key in resp_json['data']:
-        name = key['fields']['name']
-
-        # Test plan status field created by Rob (drop down options in vRel only)
-        status = key['fields'].get('test_plan_status$35')
-
-        # Archived state of test plan (applies to all projects)
-        archived = key['archived']
-        if status == 2503:
-          active_plans.insert(0, name)
-          print('{}: [ACTIVE]'.format(name))
-        elif not archived:
-          active_plans.append(name)
-          print('{}: [NOT ARCHIVED & NOT ACTIVE]'.format(name))
-        else:
-          print('{}: [ARCHIVED]'.format(name))
-
-    # If response code is not ok (200), print the resulting http error code with description
+  testplans = get_all_pages(url, 'testplans', username, password, ssl_verify, params=dict(project=project),
+                            page_size=page_size, max_workers=max_workers)
+  print('found {} testplans:'.format(len(testplans)))
+
+  for key in testplans:
+    name = key['fields']['name']
+
+    # Test plan status field created by Rob (drop down options in vRel only)
+    status = key['fields'].get('test_plan_status$35')
+
+    # Archived state of test plan (applies to all projects)
+    archived = key['archived']
+    if status == 2503:
+      active_plans.insert(0, name)
+      print('{}: [ACTIVE]'.format(name))
+    elif not archived:
+      active_plans.append(name)
+      print('{}: [NOT ARCHIVED & NOT ACTIVE]'.format(name))
     else:
-      myResponse.raise_for_status()
+      print('{}: [ARCHIVED]'.format(name))
+
+  return active_plans
+
 
-  return active_plans
\ No newline at end of file
+'''Gets the testcycles of a testplan
+
+Parameters:
+  url (string): The base url of the Jama instance
+  testplan_id (int): The testplan ID
+
+Returns:
+  testcycles (list): A list of the testcycle items in the testplan
+'''
+def get_testplan_testcycles(url, testplan_id, username, password, ssl_verify=True, page_size=MAX_PAGE_SIZE,
+                            max_workers=DEFAULT_PAGE_WORKERS, request_slots=None):
+  return get_all_pages(url, 'testplans/{}/testcycles'.format(testplan_id), username, password, ssl_verify,
+                       page_size=page_size, max_workers=max_workers, request_slots=request_slots)
+
+
+'''Gets the testruns of a testcycle
+
+Parameters:
+  url (string): The base url of the Jama instance
+  testcycle_id (int): The testcycle ID
+
+Returns:
+  testruns (list): A list of the testruns in the testcycle
+'''
+def get_testcycle_testruns(url, testcycle_id, username, password, ssl_verify=True, page_size=MAX_PAGE_SIZE,
+                           max_workers=DEFAULT_PAGE_WORKERS, request_slots=None):
+  return get_all_pages(url, 'testcycles/{}/testruns'.format(testcycle_id), username, password, ssl_verify,
+                       page_size=page_size, max_workers=max_workers, request_slots=request_slots)
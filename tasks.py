@@ -1,16 +1,23 @@
 import pandas
 import os
-import redis
+import time
 import testrun_utils
 import redis_data
+import redis_checkpoint
+import local_snapshot
+import jama_metadata
+import jama_session
+import rest_client
 import logging
 
 from celery import Celery
 from celery.utils.log import get_task_logger
 
 
-celery_app = Celery('iDirect Contour Reports App', broker=os.environ['REDIS_URL'])
-redis_instance = redis.StrictRedis.from_url(os.environ['REDIS_URL'])
+celery_app = Celery('iDirect Contour Reports App', broker=os.environ.get('REDIS_URL'))
+# Redis connections are pooled by redis_data. Without REDIS_URL, update_data() writes the
+# data to a local snapshot instead.
+redis_instance = redis_data.get_redis_inst()
 logger = get_task_logger(__name__)
 log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 logging.basicConfig(format=log_format,
@@ -30,6 +37,76 @@ def setup_periodic_tasks(sender, **kwargs):
     )
 
 
+'''Read the Jama download options from the environment'''
+def get_retrieve_options():
+    # number of test cycles and test plans to download from Jama at the same time
+    max_workers = int(os.environ.get('JAMA_MAX_WORKERS', 1))
+    max_plans = int(os.environ.get('JAMA_MAX_PLANS', 1))
+    # cap on the number of Jama requests in flight across all test plans
+    max_requests = os.environ.get('JAMA_MAX_REQUESTS')
+    max_requests = int(max_requests) if max_requests is not None else None
+    # seconds to reuse the Jama item types and pick lists before downloading them again
+    metadata_ttl = float(os.environ.get('JAMA_METADATA_TTL', jama_metadata.DEFAULT_TTL))
+    metadata_cache = jama_metadata.jama_metadata_cache(ttl=metadata_ttl) if metadata_ttl > 0 else None
+    # 'threads' (default) or 'async' to download with asyncio coroutines
+    engine = os.environ.get('JAMA_ENGINE', testrun_utils.ENGINE_THREADS)
+    # completed downloads are written to Redis as they finish and kept for JAMA_CHECKPOINT_TTL seconds, so a
+    # refresh that fails or is cut short by a worker restart resumes from them
+    checkpoint_ttl = int(os.environ.get('JAMA_CHECKPOINT_TTL', redis_checkpoint.DEFAULT_TTL))
+    checkpoint = redis_checkpoint.redis_checkpoint(redis_instance, ttl=checkpoint_ttl) \
+        if redis_instance is not None else None
+    # results per page and number of pages requested at the same time for paged Jama listings
+    page_size = int(os.environ.get('JAMA_PAGE_SIZE', rest_client.MAX_PAGE_SIZE))
+    page_workers = int(os.environ.get('JAMA_PAGE_WORKERS', rest_client.DEFAULT_PAGE_WORKERS))
+    return dict(max_workers=max_workers, max_plans=max_plans, max_requests=max_requests,
+                metadata_cache=metadata_cache, engine=engine, checkpoint=checkpoint,
+                page_size=page_size, page_workers=page_workers)
+
+
+'''Set up the shared Jama HTTP session from the environment'''
+def configure_jama_session():
+    # keep at least one connection per request in flight, see jama_client for the default cap
+    max_requests = os.environ.get('JAMA_MAX_REQUESTS')
+    if max_requests is None:
+        max_requests = int(os.environ.get('JAMA_MAX_WORKERS', 1)) * \
+            int(os.environ.get('JAMA_PAGE_WORKERS', rest_client.DEFAULT_PAGE_WORKERS))
+    max_requests = int(max_requests)
+    pool_size = int(os.environ.get('JAMA_POOL_SIZE', max(jama_session.DEFAULT_POOL_SIZE, max_requests)))
+    retries = int(os.environ.get('JAMA_RETRIES', jama_session.DEFAULT_RETRIES))
+    backoff_factor = float(os.environ.get('JAMA_BACKOFF_FACTOR', jama_session.DEFAULT_BACKOFF_FACTOR))
+    # 'record' saves every Jama response to JAMA_ARCHIVE_PATH, 'replay' serves them from it without network access
+    mode = os.environ.get('JAMA_TRANSPORT_MODE', jama_session.MODE_LIVE)
+    archive_path = os.environ.get('JAMA_ARCHIVE_PATH', jama_session.DEFAULT_ARCHIVE_PATH)
+    # responses with validators are cached in JAMA_CACHE_PATH and revalidated with conditional requests
+    cache_path = os.environ.get('JAMA_CACHE_PATH')
+    jama_session.configure(pool_size=pool_size, retries=retries, backoff_factor=backoff_factor,
+                           mode=mode, archive_path=archive_path, cache_path=cache_path)
+
+
+'''Get the dataset and watermarks to update incrementally
+
+Incremental sync is enabled with JAMA_INCREMENTAL_SYNC. A full download is still done every
+JAMA_FULL_SYNC_INTERVAL seconds (default: one day) to drop test runs deleted in Jama.
+
+Returns:
+    base_df (dataframe): The dataset in Redis, or None for a full download
+    watermarks (dict): The modifiedDate watermark of each test plan, or None for a full download
+'''
+def get_sync_base():
+    if os.environ.get('JAMA_INCREMENTAL_SYNC') is None or redis_instance is None:
+        return None, None
+    full_sync_interval = float(os.environ.get('JAMA_FULL_SYNC_INTERVAL', 86400))
+    full_sync_time = redis_data.get_full_sync_time(redis_instance)
+    if full_sync_time is None or time.time() - full_sync_time >= full_sync_interval:
+        logger.warning('Full reconciliation due, downloading all test runs')
+        return None, None
+    watermarks = redis_data.get_sync_watermarks(redis_instance)
+    base_df = redis_data.get_dataframe(redis_instance)
+    if base_df is None or len(watermarks) == 0:
+        return None, None
+    return base_df, watermarks
+
+
 @celery_app.task
 def update_data():
     jama_url = os.environ.get('JAMA_API_URL')
@@ -39,20 +116,31 @@ def update_data():
     if jama_url is None:
         jama_url = 'https://paperclip.idirect.net'
 
+    # download options for testrun_utils.sync_testruns
+    configure_jama_session()
+    retrieve_options = get_retrieve_options()
+    base_df, watermarks = get_sync_base()
+
     try:
-        df = testrun_utils.retrieve_testruns(jama_username=jama_api_username, jama_password=jama_api_password, ssl_verify=True)
-        df.fillna("",inplace=True)
+        df, watermarks = testrun_utils.sync_testruns(jama_username=jama_api_username, jama_password=jama_api_password,
+                                                     base_df=base_df, watermarks=watermarks, ssl_verify=True,
+                                                     **retrieve_options)
+        df = testrun_utils.fill_missing(df)
         df.to_csv('contour_data.csv', index=False)
 
     except Exception as e:
+        # downloads completed before the failure are checkpointed, so the retry only repeats the rest
         logger.error(f'Caught exception {e} trying to get test runs. Trying again without SSL verification...')
         
         try:
-            df = testrun_utils.retrieve_testruns(jama_username=jama_api_username, jama_password=jama_api_password, ssl_verify=False)
-            df.fillna("",inplace=True)
+            df, watermarks = testrun_utils.sync_testruns(jama_username=jama_api_username, jama_password=jama_api_password,
+                                                         base_df=base_df, watermarks=watermarks, ssl_verify=False,
+                                                         **retrieve_options)
+            df = testrun_utils.fill_missing(df)
             df.to_csv('contour_data.csv', index=False)
 
         except Exception as e:
+            # the checkpoints are kept, so the next refresh resumes from the downloads completed so far
             logger.error(f'Caught exception {e} trying to get test runs. Exiting...')
             return
 
@@ -60,22 +148,22 @@ def update_data():
         logger.error('Cannot retrieve data from Jama/Contour server. Check config file!')
         return
 
-    # compare data with existing data in redis
-    redis_df = redis_data.get_dataframe(redis_instance)
-
-    df_json = testrun_utils.df_to_json(df)
-    redif_df_json = testrun_utils.df_to_json(redis_df) if redis_df is not None else None
+    if redis_instance is None:
+        # single-host deployments without Redis read the data from a local snapshot
+        local_snapshot.write_snapshot(df)
+        logger.warning(f'Data written to local snapshot {local_snapshot.get_snapshot_path()}')
+        return
 
-    modified = True
-    if redif_df_json is not None:
-        if df_json == redif_df_json:
-            logger.warning('Data unchanged, will not update in Redis data store')
-            redis_data.set_updated_datetime(redis_instance)
-            return
+    # the download completed, the next refresh starts from scratch
+    retrieve_options['checkpoint'].clear()
 
-    logger.warning('Data changed. will update in Redis data store')
-    redis_data.set_dataframe(redis_instance, df)
-    redis_data.set_modified_datetime(redis_instance)
+    # only the test plans whose content hash changed are written to redis, together with
+    # the modified and updated times and the incremental sync state
+    changed = redis_data.set_dataframe(redis_instance, df, watermarks=watermarks, full_sync=base_df is None)
+    if changed:
+        logger.warning('Data changed. Updated in Redis data store')
+    else:
+        logger.warning('Data unchanged, will not update in Redis data store')
 
-    # set updated time
-    redis_data.set_updated_datetime(redis_instance)
\ No newline at end of file
+    # the status counts of the day for the test progress chart, kept up to date while the data changes
+    redis_data.update_status_snapshots(redis_instance, df, force=changed)
@@ -1,22 +1,60 @@
 from datetime import timedelta, date, datetime
+from concurrent.futures import ThreadPoolExecutor
 from dateutil import parser
 import pandas as pd
 import json
+import hashlib
+import zlib
 import plotly
 from tzlocal import get_localzone
 from os.path import expanduser, isfile
 from jama_client import jama_client
 from jama_client import COL_PROJECT, COL_TESTPLAN, COL_TESTCYCLE, COL_TESTGROUP, COL_TESTRUN
 from jama_client import COL_CREATED_DATE, COL_MODIFIED_DATE, COL_EXECUTION_DATE, COL_PLANNED_WEEK
-from jama_client import COL_STATUS, COL_PRIORITY, COL_NETWORK_TYPE
+from jama_client import COL_STATUS, COL_PRIORITY, COL_NETWORK_TYPE, COL_TESTRUN_ID
+from jama_client import TESTRUN_COLUMNS, to_categorical
 import rest_client
 
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
 
 ALL_TEST_CYCLES = 'All Test Cycles'
 ALL_TEST_GROUPS = 'All Test Groups'
 ALL_PRIORITIES = 'All'
 ALL_WEEKS = 'All Weeks'
 
+# Jama download engines
+ENGINE_THREADS = 'threads'
+ENGINE_ASYNC = 'async'
+
+# daily status snapshots, see get_status_snapshot()
+COL_SNAPSHOT_DATE = 'date'
+SNAPSHOT_GROUP_COLUMNS = [COL_TESTPLAN, COL_TESTCYCLE, COL_TESTGROUP, COL_PRIORITY, COL_PLANNED_WEEK]
+
+# dataset payload formats, see df_to_payload()
+PAYLOAD_MAGIC = b'TRDS/'
+FORMAT_JSON = 'json'
+FORMAT_ARROW = 'arrow'
+# dataset payload compression codecs
+CODEC_NONE = 'none'
+CODEC_ZSTD = 'zstd'
+CODEC_LZ4 = 'lz4'
+CODEC_ZLIB = 'zlib'
+DATE_COLUMNS = [COL_CREATED_DATE, COL_MODIFIED_DATE, COL_EXECUTION_DATE]
+
 
 class JamaReportsConfig:
     config = None
@@ -40,11 +78,14 @@ class JamaReportsConfig:
         username (string): The Jama username
         password (string): The Jama password
         ssl_verify (bool): Whether or not to use SSL verification accessing the API
+        page_size (int): The number of testplans per page
+        page_workers (int): The number of pages of testplans to download at the same time
 
     Returns:
         True if successful
     '''
-    def read_config_file(self, username, password, ssl_verify=True):
+    def read_config_file(self, username, password, ssl_verify=True, page_size=rest_client.MAX_PAGE_SIZE,
+                         page_workers=rest_client.DEFAULT_PAGE_WORKERS):
         # look for config file
         for settings_dir in [expanduser('~'), '.']:
             path = settings_dir + '/' + self.config_file_name
@@ -79,7 +120,8 @@ class JamaReportsConfig:
 
         # get all active test plans from projects
         for project in projects:
-            active_plans = rest_client.get_active_testplans(self.url, project, username, password, ssl_verify)
+            active_plans = rest_client.get_active_testplans(self.url, project, username, password, ssl_verify,
+                                                            page_size=page_size, max_workers=page_workers)
             for plan in active_plans:
                 title = '{}: {}'.format(project, plan)
                 # add plan to lookup
@@ -282,32 +324,50 @@ def get_testruns_for_current_week(df, testcycle_key=None, testgroup_key=None, pr
 
 '''Gets status of test runs over time
 
+Days covered by the daily status snapshots are read from the snapshots, see
+get_status_snapshot(). Earlier days are rebuilt from the created and modified dates of the
+test runs.
+
 Parameters:
     df (dataframe): The test run data
     testcycle_key (string): The test cycle
     testgroup_key (string): The test group
     priority_key (string): The selected priority
     start_date (string): The oldest date to consider
+    snapshots (dataframe): The daily status snapshots of the test plan, or None
     
 Returns
     df3 (dataframe): A dataframe containing the historical statuses of the test runs
 '''
-def get_testrun_status_historical(df, testcycle_key=None, testgroup_key=None, priority_key=None, start_date=None):
+def get_testrun_status_historical(df, testcycle_key=None, testgroup_key=None, priority_key=None, start_date=None,
+                                  snapshots=None):
+    # set tomorrow's date as end date
+    end_date = datetime.now().date() # today 11:59:59 pm
+    series = None
+    if snapshots is not None:
+        series = filter_df(snapshots, testcycle_key=testcycle_key, testgroup_key=testgroup_key,
+                           priority_key=priority_key)
+        series = series.groupby(COL_SNAPSHOT_DATE)[get_status_names()].sum().reset_index() \
+            if not series.empty else None
+    if series is not None:
+        # only rebuild the days before the first snapshot
+        end_date = series[COL_SNAPSHOT_DATE].min().date() - timedelta(days=1)
+        if start_date is not None:
+            series = series[series[COL_SNAPSHOT_DATE] >= pd.Timestamp(start_date).normalize()]
+
     df1 = filter_df(df, testcycle_key=testcycle_key, testgroup_key=testgroup_key, priority_key=priority_key)
     if df1.empty:
-        return None
+        return series
     # set lowest modified date - 1 as start date
     if start_date is None:
-        start_date = df1[COL_MODIFIED_DATE].values.min()
-    # set tomorrow's date as end date
-    end_date = datetime.now().date() # today 11:59:59 pm
+        start_date = df1[COL_MODIFIED_DATE].min()
     # get local time zone
     local_tz = get_localzone()
     # create a date range using start and end dates from above set to the local TZ
     daterange = pd.date_range(start_date, end_date)
     t = []
     for d in daterange:
-        # create a dataframe of all test runs created before date 'd'
+        # create a dataframe of all test runs created before date 'd', the dates are datetime64 columns
         df2 = df1[df1[COL_CREATED_DATE] <= d]
         if df2.empty:
             # no test runs found - we will not consider this date
@@ -322,48 +382,197 @@ def get_testrun_status_historical(df, testcycle_key=None, testgroup_key=None, pr
 
     df3 = pd.DataFrame(t, columns=['date'] + get_status_names())
     df3['date'] = pd.to_datetime(df3['date'])
+    if series is not None:
+        df3 = pd.concat([df3, series], ignore_index=True)
     return df3
 
 
+'''Gets the status counts of the test runs on a day, one row per test plan, test cycle,
+test group, priority and planned week
+
+Parameters:
+    df (dataframe): The test run data
+    day (date): The day of the snapshot, today if None
+
+Returns:
+    snapshot (dataframe): The date, the group columns and a count column per status
+'''
+def get_status_snapshot(df, day=None):
+    day = day if day is not None else datetime.now().date()
+    df1 = fill_missing(df[SNAPSHOT_GROUP_COLUMNS + [COL_STATUS]])
+    if df1.empty:
+        snapshot = pd.DataFrame(columns=SNAPSHOT_GROUP_COLUMNS + get_status_names())
+    else:
+        counts = df1.groupby(SNAPSHOT_GROUP_COLUMNS + [COL_STATUS], sort=False, observed=True).size()
+        snapshot = counts.unstack(COL_STATUS, fill_value=0).reindex(columns=get_status_names(), fill_value=0)
+        snapshot = snapshot.reset_index()
+        snapshot.columns.name = None
+    snapshot.insert(0, COL_SNAPSHOT_DATE, pd.Timestamp(day))
+    return snapshot
+
+
 '''Connect to JAMA server, download testruns for all testplans and return testruns as a JSON
 
 Parameters:
     jama_username (string): The username for the Jama login
     jama_password (string): The password for the Jama login
+    ssl_verify (bool): Whether or not to use SSL verification accessing the API
+    max_workers (int): The number of test cycles to download at the same time
+    max_plans (int): The number of test plans to download at the same time
+    max_requests (int): The maximum number of Jama requests in flight across all test plans
+    metadata_cache (jama_metadata_cache): Cache for the Jama item types and pick lists, or None
+    engine (string): ENGINE_THREADS or ENGINE_ASYNC to download with asyncio coroutines
+    checkpoint (redis_checkpoint): Store of completed downloads to resume a failed refresh, or None
+    page_size (int): The number of results per page of paged Jama listings
+    page_workers (int): The number of pages of a Jama listing to download at the same time
 
 Returns:
     df (JSON): All of the testruns as a JSON
 '''
-def retrieve_testruns(jama_username: str, jama_password: str, ssl_verify=True):
+def retrieve_testruns(jama_username: str, jama_password: str, ssl_verify=True, max_workers=1, max_plans=1,
+                      max_requests=None, metadata_cache=None, engine=ENGINE_THREADS, checkpoint=None,
+                      page_size=rest_client.MAX_PAGE_SIZE, page_workers=rest_client.DEFAULT_PAGE_WORKERS):
+    df, _ = sync_testruns(jama_username=jama_username, jama_password=jama_password, ssl_verify=ssl_verify,
+                          max_workers=max_workers, max_plans=max_plans, max_requests=max_requests,
+                          metadata_cache=metadata_cache, engine=engine, checkpoint=checkpoint,
+                          page_size=page_size, page_workers=page_workers)
+    return df
+
+
+'''Connect to JAMA server and bring a previously retrieved testrun dataframe up to date
+
+Test plans with a modifiedDate watermark that are present in base_df are updated
+incrementally: only testruns modified since the watermark are downloaded and upserted
+by testrun ID. All other test plans are downloaded in full. Without base_df or
+watermarks this is a full download of every test plan.
+
+Parameters:
+    jama_username (string): The username for the Jama login
+    jama_password (string): The password for the Jama login
+    base_df (dataframe): The previously retrieved testruns
+    watermarks (dict): The modifiedDate watermark of each testplan name in base_df
+    ssl_verify (bool): Whether or not to use SSL verification accessing the API
+    max_workers (int): The number of test cycles to download at the same time
+    max_plans (int): The number of test plans to download at the same time
+    max_requests (int): The maximum number of Jama requests in flight across all test plans
+    metadata_cache (jama_metadata_cache): Cache for the Jama item types and pick lists, or None
+    engine (string): ENGINE_THREADS or ENGINE_ASYNC to download with asyncio coroutines
+    checkpoint (redis_checkpoint): Store of completed downloads to resume a failed refresh, or None.
+        Only used by the threads engine.
+    page_size (int): The number of results per page of paged Jama listings
+    page_workers (int): The number of pages of a Jama listing to download at the same time
+
+Returns:
+    df (dataframe): All of the testruns, or None if the config or the Jama connection is invalid
+    watermarks (dict): The new modifiedDate watermark of each testplan name
+
+Raises:
+    Exception: A test plan could not be downloaded. Test plans that cannot be found in Jama are
+        left out instead.
+'''
+def sync_testruns(jama_username: str, jama_password: str, base_df=None, watermarks=None, ssl_verify=True,
+                  max_workers=1, max_plans=1, max_requests=None, metadata_cache=None, engine=ENGINE_THREADS,
+                  checkpoint=None, page_size=rest_client.MAX_PAGE_SIZE, page_workers=rest_client.DEFAULT_PAGE_WORKERS):
     # try to read config file and pull projects
     config = JamaReportsConfig()
-    if not config.read_config_file(jama_username, jama_password, ssl_verify):
+    if not config.read_config_file(jama_username, jama_password, ssl_verify, page_size=page_size,
+                                   page_workers=page_workers):
         print('Error reading config file!')
-        return None
-    client = jama_client(blocking_as_not_run=False, inprogress_as_not_run=False)
+        return None, None
+    if engine == ENGINE_ASYNC:
+        from jama_async_client import jama_async_client
+        client = jama_async_client(blocking_as_not_run=False, inprogress_as_not_run=False,
+                                   **({} if max_requests is None else dict(max_requests=max_requests)))
+    else:
+        client = jama_client(blocking_as_not_run=False, inprogress_as_not_run=False, max_workers=max_workers,
+                             max_requests=max_requests, checkpoint=checkpoint, page_size=page_size,
+                             page_workers=page_workers)
     jama_url = config.get_url()
     projects = config.get_projects()
     if len(projects) == 0:
         print('No projects found in config file')
-        return None
-    if not client.connect(url=jama_url, username=jama_username, password=jama_password, ssl_verify=ssl_verify):
+        return None, None
+    if not client.connect(url=jama_url, username=jama_username, password=jama_password, ssl_verify=ssl_verify,
+                          metadata_cache=metadata_cache):
         print('Error getting data from Jama/Contour')
-        return None
+        return None, None
+
+    # incremental updates need a testrun ID to upsert the modified testruns
+    if base_df is None or watermarks is None or COL_TESTRUN_ID not in base_df.columns:
+        base_df = None
+        watermarks = {}
+
+    # the previously retrieved test runs of a test plan that can be updated incrementally, otherwise None
+    def get_base_plan_df(testplan_name):
+        if base_df is None or watermarks.get(testplan_name) is None:
+            return None
+        base_plan_df = base_df[base_df[COL_TESTPLAN].eq(testplan_name)]
+        return base_plan_df if not base_plan_df.empty else None
+
+    testplan_names = config.get_testplan_names()
+
+    # query the test runs modified since the oldest watermark once per project, retrieve_modified_testruns
+    # below then picks the test runs of each test plan from the results
+    project_since = {}
+    for testplan_name in testplan_names:
+        if get_base_plan_df(testplan_name) is not None:
+            project, _ = config.get_project_and_testplan(testplan_ui_key=testplan_name)
+            since = watermarks[testplan_name]
+            project_since[project] = min(since, project_since.get(project, since))
+    for project, since in project_since.items():
+        client.retrieve_modified_project_testruns(project_id=project, since=since)
+
+    if engine == ENGINE_ASYNC:
+        # download all test plans that need a full download on one event loop, retrieve_testruns
+        # below then returns them from the client cache
+        client.retrieve_all_testruns([config.get_project_and_testplan(testplan_ui_key=x) for x in testplan_names
+                                      if get_base_plan_df(x) is None])
 
     # download test runs
-    frames = []
-    for testplan_name in config.get_testplan_names():
+    def retrieve_testplan(testplan_name):
         project, testplan = config.get_project_and_testplan(testplan_ui_key=testplan_name)
-        df = client.retrieve_testruns(project_id=project, testplan_key=testplan)
+        base_plan_df = get_base_plan_df(testplan_name)
+        if base_plan_df is not None:
+            df = client.retrieve_modified_testruns(project_id=project, testplan_key=testplan,
+                                                   since=watermarks[testplan_name])
+        else:
+            df = client.retrieve_testruns(project_id=project, testplan_key=testplan)
         if df is None:
-            # skip
-            continue
+            return None
         # remove project column and replace testplan with testplan_name
         df1 = df.drop(columns=[COL_PROJECT])
-        df1[COL_TESTPLAN].replace({testplan: testplan_name}, inplace=True)
-        frames.append(df1)
-    df = pd.concat(frames)
-    return df
+        df1[COL_TESTPLAN] = df1[COL_TESTPLAN].replace({testplan: testplan_name})
+        if base_plan_df is not None:
+            # upsert the modified test runs into the previously retrieved ones
+            print('updating {} modified test runs in test plan {}'.format(df1.shape[0], testplan_name))
+            base_plan_df = base_plan_df[~base_plan_df[COL_TESTRUN_ID].isin(df1[COL_TESTRUN_ID])]
+            # the dates of both frames must be datetime64, or concat falls back to mixed object columns
+            base_plan_df = __normalize_dates(base_plan_df)
+            df1 = to_categorical(pd.concat([base_plan_df, __normalize_dates(df1)]))
+        return df1
+
+    if max_plans > 1 and len(testplan_names) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_plans, len(testplan_names))) as executor:
+            # map() keeps the frames in config order
+            results = list(executor.map(retrieve_testplan, testplan_names))
+    else:
+        results = [retrieve_testplan(x) for x in testplan_names]
+
+    # skip test plans that could not be found
+    frames = []
+    new_watermarks = {}
+    for testplan_name, df in zip(testplan_names, results):
+        if df is None:
+            continue
+        frames.append(df)
+        project, testplan = config.get_project_and_testplan(testplan_ui_key=testplan_name)
+        watermark = client.get_modified_watermark(project_id=project, testplan_key=testplan)
+        if watermark is None:
+            watermark = watermarks.get(testplan_name)
+        if watermark is not None:
+            new_watermarks[testplan_name] = watermark
+    df = to_categorical(pd.concat(frames))
+    return df, new_watermarks
 
 
 '''Get list of priorities given testplan, testcycle, and testgroup
@@ -485,19 +694,239 @@ def get_planned_week_from_label(label):
     return None if label == ALL_WEEKS else label
 
 
+'''Get a dataframe without test runs, with the columns and types of the dataset'''
+def get_empty_df():
+    df = pd.DataFrame(columns=[x for x in TESTRUN_COLUMNS if x != COL_PROJECT])
+    for col in DATE_COLUMNS:
+        df[col] = pd.to_datetime(df[col])
+    return to_categorical(df)
+
+
+'''Replaces the missing values of a dataframe
+
+The value is added to the categories of categorical columns that have missing values,
+which DataFrame.fillna() does not do.
+
+Returns:
+    df (dataframe): A copy of the dataframe without missing values
+'''
+def fill_missing(df, value=''):
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_categorical_dtype(df[col]) and value not in df[col].cat.categories \
+                and df[col].isna().any():
+            df[col] = df[col].cat.add_categories([value])
+    return df.fillna(value)
+
+
 '''Converts dataframe to JSON format'''
 def df_to_json(df: pd.DataFrame):
     return df.to_json(date_format='iso', orient='split') \
         if df is not None else None
 
 
-'''Converts JSON to dataframe format'''
+'''Converts JSON to dataframe format
+
+The dates are returned as datetime64 columns, like the test runs downloaded from Jama.
+'''
 def json_to_df(json_str):
     df = pd.read_json(json_str, orient='split')
-    convert_date_column = lambda df, col, fmt: pd.to_datetime(df[col], format=fmt).dt.date
-    date_format='%Y-%m-%d'
-    df[COL_CREATED_DATE] = convert_date_column(df, COL_CREATED_DATE, date_format)
-    df[COL_MODIFIED_DATE] = convert_date_column(df, COL_MODIFIED_DATE, date_format)
-    df[COL_EXECUTION_DATE] = convert_date_column(df, COL_EXECUTION_DATE, date_format)
-    #df[COL_PLANNED_WEEK] = convert_date_column(df, COL_PLANNED_WEEK, date_format)
+    # dates are written as plain dates by earlier versions and as ISO datetimes in UTC otherwise
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], utc=True).dt.tz_localize(None)
+    return to_categorical(df)
+
+
+'''Returns a copy of the dataframe with the dates as datetimes, whether they are stored as dates, datetimes or strings'''
+def __normalize_dates(df):
+    df = df.copy()
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
     return df
+
+
+'''Get a stable hash of the contents of a dataframe
+
+The dates are hashed as datetimes whether they are stored as dates, datetimes or strings,
+so the same test runs give the same hash however they were loaded.
+
+Returns:
+    hash (string): The hex digest of the column names and values, in row order
+'''
+def get_df_hash(df: pd.DataFrame):
+    df = __normalize_dates(df.reset_index(drop=True))
+    digest = hashlib.sha1(json.dumps(list(df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+'''Get the row-level differences between two versions of the test runs, matched by testrun ID
+
+Parameters:
+    old_df (dataframe): The previous test runs
+    new_df (dataframe): The current test runs
+
+Returns:
+    delta (dict): 'added' and 'changed' hold the new and modified rows of new_df, 'removed'
+        the list of testrun IDs that are no longer in new_df
+'''
+def get_df_delta(old_df, new_df):
+    old_ids = old_df[COL_TESTRUN_ID]
+    new_ids = new_df[COL_TESTRUN_ID]
+    added = new_df[~new_ids.isin(old_ids)]
+    removed = [int(x) for x in old_ids[~old_ids.isin(new_ids)]]
+
+    new_common = __normalize_dates(new_df[new_ids.isin(old_ids)]).set_index(COL_TESTRUN_ID).astype(object)
+    old_common = __normalize_dates(old_df[old_ids.isin(new_ids)]).set_index(COL_TESTRUN_ID).astype(object)
+    old_common = old_common.reindex(index=new_common.index, columns=new_common.columns)
+    equal = ((new_common == old_common) | (new_common.isna() & old_common.isna())).all(axis=1)
+    changed = new_df[new_ids.isin(new_common.index[~equal.values])]
+    return dict(added=added, changed=changed, removed=removed)
+
+
+'''Applies the differences returned by get_df_delta() to the previous test runs
+
+Changed and added test runs are moved to the end of the dataframe. 'added' and 'changed'
+may be None when there are no such test runs. Applying the same delta twice gives the same
+result.
+'''
+def apply_df_delta(df, delta):
+    changed = delta.get('changed')
+    added = delta.get('added')
+    replaced = list(delta.get('removed', []))
+    for frame in [changed, added]:
+        if frame is not None:
+            replaced += [int(x) for x in frame[COL_TESTRUN_ID]]
+    frames = [df[~df[COL_TESTRUN_ID].isin(replaced)], changed, added]
+    return to_categorical(pd.concat([x for x in frames if x is not None], ignore_index=True))
+
+
+'''Get the default dataset payload format, Arrow if pyarrow is installed'''
+def get_default_payload_format():
+    return FORMAT_ARROW if pa is not None else FORMAT_JSON
+
+
+'''Get the default dataset payload codec, the best compression installed'''
+def get_default_payload_codec():
+    if zstandard is not None:
+        return CODEC_ZSTD
+    if lz4 is not None:
+        return CODEC_LZ4
+    return CODEC_ZLIB
+
+
+'''Compresses bytes with a payload codec'''
+def compress_bytes(data, codec):
+    if codec == CODEC_NONE:
+        return data
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ImportError('The zstd codec requires the zstandard package')
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == CODEC_LZ4:
+        if lz4 is None:
+            raise ImportError('The lz4 codec requires the lz4 package')
+        return lz4.frame.compress(data)
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, 6)
+    raise ValueError(f'Unknown dataset codec {codec}')
+
+
+'''Decompresses bytes compressed by compress_bytes()'''
+def decompress_bytes(data, codec):
+    if codec == CODEC_NONE:
+        return data
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ImportError('The zstd codec requires the zstandard package')
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == CODEC_LZ4:
+        if lz4 is None:
+            raise ImportError('The lz4 codec requires the lz4 package')
+        return lz4.frame.decompress(data)
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    raise ValueError(f'Unknown dataset codec {codec}')
+
+
+'''Converts dataframe to an Arrow table
+
+Raises:
+    ArrowInvalid, ArrowTypeError: If a column holds values of mixed types
+'''
+def df_to_table(df: pd.DataFrame):
+    if pa is None:
+        raise ImportError('The Arrow dataset format requires the pyarrow package')
+    # empty strings left by fill_missing() become NaT
+    return pa.Table.from_pandas(__normalize_dates(df), preserve_index=False)
+
+
+'''Converts an Arrow table written by df_to_table() to dataframe format
+
+The dates come back as the datetime64 columns they were written from.
+'''
+def table_to_df(table):
+    # categorical columns are stored as Arrow dictionaries and come back as categoricals
+    return to_categorical(table.to_pandas())
+
+
+'''Converts dataframe to a tagged payload
+
+The payload starts with a header naming its format and compression codec, e.g.
+b'TRDS/arrow+zstd\n', followed by the compressed dataset as an Arrow IPC stream or as JSON.
+Payloads written before the header was added are plain JSON and are still read by
+payload_to_df(), as are payloads without a codec in the header.
+
+Parameters:
+    df (dataframe): The test run data
+    fmt (string): FORMAT_ARROW or FORMAT_JSON, None for the default format
+    codec (string): One of the CODEC_ constants, None for the default codec
+
+Returns:
+    payload (bytes): The encoded dataset
+'''
+def df_to_payload(df: pd.DataFrame, fmt=None, codec=None):
+    if df is None:
+        return None
+    fmt = fmt if fmt is not None else get_default_payload_format()
+    codec = codec if codec is not None else get_default_payload_codec()
+    if fmt == FORMAT_ARROW:
+        if pa is None:
+            raise ImportError('The Arrow dataset format requires the pyarrow package')
+        try:
+            table = df_to_table(df)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            print(f'Cannot encode dataset as Arrow, using JSON - {e}')
+            return df_to_payload(df, fmt=FORMAT_JSON, codec=codec)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        body = sink.getvalue().to_pybytes()
+    elif fmt == FORMAT_JSON:
+        body = df_to_json(df).encode('utf-8')
+    else:
+        raise ValueError(f'Unknown dataset format {fmt}')
+    header = PAYLOAD_MAGIC + f'{fmt}+{codec}'.encode('ascii') + b'\n'
+    return header + compress_bytes(body, codec)
+
+
+'''Converts a payload written by df_to_payload(), or legacy JSON, to dataframe format'''
+def payload_to_df(payload):
+    if payload is None:
+        return None
+    if isinstance(payload, str):
+        return json_to_df(payload)
+    if not payload.startswith(PAYLOAD_MAGIC):
+        return json_to_df(payload.decode('utf-8'))
+    header_end = payload.index(b'\n')
+    fmt, _, codec = payload[len(PAYLOAD_MAGIC):header_end].decode('ascii').partition('+')
+    body = decompress_bytes(memoryview(payload)[header_end + 1:], codec or CODEC_NONE)
+    if fmt == FORMAT_JSON:
+        return json_to_df(bytes(body).decode('utf-8'))
+    if fmt == FORMAT_ARROW:
+        if pa is None:
+            raise ImportError('The Arrow dataset format requires the pyarrow package')
+        return table_to_df(pa.ipc.open_stream(pa.py_buffer(body)).read_all())
+    raise ValueError(f'Unknown dataset format {fmt}')